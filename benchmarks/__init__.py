@@ -0,0 +1,5 @@
+"""
+Benchmarks for Pyramid Tasks.  Run the full suite with ``python -m
+benchmarks``.
+
+"""
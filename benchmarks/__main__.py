@@ -0,0 +1,196 @@
+"""
+Benchmark suite measuring the overhead Pyramid Tasks adds to deferring and
+executing tasks.  Everything runs offline on Celery's in-memory transport and
+result backend.
+
+    python -m benchmarks [--quick] [--output results.json]
+
+Results are written as JSON so they can be compared between releases.
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+from celery.contrib.testing.worker import start_worker
+from kombu import serialization
+from pyramid.config import Configurator
+from pyramid.scripting import prepare
+
+from pyramid_tasks import BeforeDeferTask
+
+SETTINGS = {
+    "celery.worker_hijack_root_logger": False,
+    "celery.worker_log_color": False,
+    "celery.accept_content": "json",
+    "celery.enable_utc": True,
+    "celery.timezone": "UTC",
+    "celery.broker_url": "memory://",
+    "celery.result_backend": "cache+memory://",
+    "celery.broker_heartbeat": 0,
+}
+
+
+def noop_task(request, *args, **kwargs):
+    return None
+
+
+def passthrough_deriver(task, info):
+    def wrapped(request, *args, **kwargs):
+        return task(request, *args, **kwargs)
+
+    return wrapped
+
+
+@contextmanager
+def make_app(subscribers=0, derivers=0, pyramid_tm=False, settings=None):
+    """
+    Create a configured application with a ``noop`` task.  Yields a tuple of
+    ``(celery_app, request)``.
+
+    """
+    config = Configurator(settings=dict(SETTINGS, **(settings or {})))
+    config.include("pyramid_tasks")
+    if pyramid_tm:
+        config.include("pyramid_tm")
+        config.include("pyramid_tasks.contrib.pyramid_tm")
+    for i in range(derivers):
+        config.add_task_deriver(passthrough_deriver, name=f"deriver{i}")
+    for _ in range(subscribers):
+        config.add_subscriber(lambda event: None, BeforeDeferTask)
+    config.register_task(noop_task, name="noop")
+    app = config.make_celery_app()
+    with prepare(registry=config.registry) as env:
+        yield app, env["request"]
+
+
+def measure(func, iterations):
+    """
+    Call ``func`` ``iterations`` times and return the mean in microseconds.
+
+    """
+    func()  # Warm up any lazily-initialized state.
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench_defer(iterations):
+    for subscribers in (0, 1, 10):
+        with make_app(subscribers=subscribers) as (_, request):
+            value = measure(lambda: request.defer_task("noop"), iterations)
+        yield "defer_task", {"subscribers": subscribers}, "us", value
+
+
+def bench_handler(iterations):
+    for derivers in (0, 1, 10):
+        with make_app(derivers=derivers) as (app, _):
+            value = measure(app.tasks["noop"].run, iterations)
+        yield "task_handler", {"derivers": derivers}, "us", value
+
+
+def bench_pyramid_tm(iterations):
+    for enabled in (False, True):
+        with make_app(pyramid_tm=enabled) as (app, _):
+            value = measure(app.tasks["noop"].run, iterations)
+        yield "pyramid_tm_deriver", {"enabled": enabled}, "us", value
+
+
+def bench_throughput(iterations):
+    with make_app() as (app, request):
+        with start_worker(app, perform_ping_check=False):
+            start = time.perf_counter()
+            calls = [("noop",)] * iterations
+            for result in request.defer_tasks(calls):
+                result.get(timeout=60)
+            elapsed = time.perf_counter() - start
+    yield "throughput", {"pool": "solo"}, "tasks/s", iterations / elapsed
+
+
+def bench_serializer(iterations):
+    payload = (
+        [{"id": i, "name": f"item {i}", "tags": ["a"]} for i in range(50)],
+        {"flag": True},
+        {"callbacks": None, "errbacks": None, "chain": None, "chord": None},
+    )
+    with make_app():
+        for serializer in ("json", "pyramid_msgpack"):
+            content_type, encoding, data = serialization.dumps(
+                payload, serializer
+            )
+            value = measure(
+                lambda: serialization.loads(
+                    serialization.dumps(payload, serializer)[2],
+                    content_type,
+                    encoding,
+                ),
+                iterations,
+            )
+            params = {"serializer": serializer, "bytes": len(data)}
+            yield "serializer_round_trip", params, "us", value
+
+
+BENCHMARKS = [
+    (bench_defer, 5000),
+    (bench_handler, 20000),
+    (bench_pyramid_tm, 20000),
+    (bench_throughput, 1000),
+    (bench_serializer, 5000),
+]
+
+
+def run(scale=1.0):
+    results = list()
+    for bench, iterations in BENCHMARKS:
+        iterations = max(int(iterations * scale), 1)
+        for name, params, unit, value in bench(iterations):
+            results.append(
+                {
+                    "name": name,
+                    "params": params,
+                    "unit": unit,
+                    "value": round(value, 3),
+                    "iterations": iterations,
+                }
+            )
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "pyramid_tasks": version("pyramid-tasks"),
+            "pyramid": version("pyramid"),
+            "celery": version("celery"),
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Run a tenth of the usual iterations.",
+    )
+    parser.add_argument(
+        "--output",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Write JSON results to this file.  Defaults to stdout.",
+    )
+    args = parser.parse_args(argv)
+    report = run(scale=0.1 if args.quick else 1.0)
+    json.dump(report, args.output, indent=2)
+    args.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
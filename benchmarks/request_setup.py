@@ -0,0 +1,65 @@
+"""
+Measure the per-task cost of building and preparing the task request.
+
+Compares the previous approach (``Request.blank`` + ``pyramid.scripting
+.prepare``) against :class:`pyramid_tasks.scripting.RequestBuilder`.
+
+    python benchmarks/request_setup.py
+
+"""
+
+import timeit
+
+from pyramid.config import Configurator
+from pyramid.interfaces import IRequestFactory
+from pyramid.request import Request
+from pyramid.scripting import prepare
+
+from pyramid_tasks.scripting import RequestBuilder
+
+NUMBER = 20000
+
+
+def make_registry(extensions=10):
+    config = Configurator()
+    for i in range(extensions):
+        config.add_request_method(lambda req: i, f"method{i}")
+        config.add_request_method(lambda req: i, f"reified{i}", reify=True)
+    config.commit()
+    return config.registry
+
+
+def blank_prepare(registry):
+    def run():
+        factory = registry.queryUtility(IRequestFactory, default=Request)
+        request = factory.blank("/", environ=None)
+        with prepare(request=request, registry=registry):
+            pass
+
+    return run
+
+
+def request_builder(registry):
+    builder = RequestBuilder(registry)
+
+    def run():
+        request = builder.make_request(None)
+        with builder.prepare(request):
+            pass
+
+    return run
+
+
+def main():
+    registry = make_registry()
+    for name, factory in [
+        ("blank+prepare", blank_prepare),
+        ("RequestBuilder", request_builder),
+    ]:
+        timings = timeit.repeat(factory(registry), number=NUMBER, repeat=5)
+        per_task = min(timings) / NUMBER * 1e6
+        print(f"{name:>16}: {per_task:.2f} µs/task")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
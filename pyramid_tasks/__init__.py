@@ -1,17 +1,34 @@
+import functools
+import inspect
+import json
+import time
+
 import celery
 import venusian
+from celery.utils import uuid
 from pyramid.interfaces import (
     PHASE1_CONFIG,
     PHASE2_CONFIG,
     PHASE3_CONFIG,
-    IRequestFactory,
 )
-from pyramid.request import Request
-from pyramid.scripting import prepare
-
-from .events import BeforeDeferTask, CeleryWorkerProcessInit
+from pyramid.settings import asbool
+
+from . import aio, prefork
+from .claimcheck import HEADER as CLAIM_CHECK_HEADER
+from .claimcheck import get_claim_check, get_offloaded
+from .context import ENVIRON_KEY as CONTEXT_ENVIRON_KEY
+from .context import HEADER as CONTEXT_HEADER
+from .context import add_context_header
+from .debounce import get_debounce_store
+from .events import (
+    BeforeDeferTask,
+    CeleryWorkerInit,
+    CeleryWorkerProcessInit,
+)
+from .executor import get_executor
+from .scripting import get_request_builder
 from .settings import extract_celery_settings
-from .taskderivers import apply_task_derivers
+from .taskderivers import apply_task_derivers, apply_task_derivers_lazily
 
 # If set, pyramid_tasks will use this Celery application rather than make a new
 # one.  This is necessary because when running a worker via an ini file (see
@@ -19,12 +36,24 @@ from .taskderivers import apply_task_derivers
 # in the app when loading the app.
 global_app = None
 
+_marker = object()
+
 
 def set_global_app(app):
     global global_app
     global_app = app
 
 
+def is_worker():
+    """
+    Return ``True`` if the application is being loaded by Celery via
+    ``celery -A pyramid_tasks``, i.e. by a worker or Celery Beat.  Useful for
+    skipping configuration unneeded by the worker, such as views and routes.
+
+    """
+    return global_app is not None
+
+
 def includeme(config):
     settings = config.get_settings()
     if global_app is None:
@@ -34,10 +63,14 @@ def includeme(config):
         )
     else:
         app = global_app
+    _connect_worker_init(config.registry)
     _connect_worker_process_init(config.registry)
     app.conf.update(extract_celery_settings(settings))
     app.pyramid_config = config
     config.registry["pyramid_tasks.app"] = app
+    config.registry["pyramid_tasks.after_commit"] = asbool(
+        settings.get("pyramid_tasks.after_commit", False)
+    )
     config.registry["pyramid_tasks.task_map"] = dict()
     config.add_directive("make_celery_app", make_celery_app)
     config.add_directive("register_task", register_task)
@@ -51,10 +84,25 @@ def includeme(config):
     )
     config.add_request_method(defer_task)
     config.add_request_method(defer_task_with_options)
+    config.add_request_method(defer_tasks)
+    config.add_request_method(defer_task_once)
     config.add_request_method(defer_task, "delay_task")  # Legacy
-    config.add_request_method(get_task_result)
     config.add_request_method(current_task, property=True)
     config.include(".taskderivers")
+    config.include(".scripting")
+    config.include(".results")
+    config.include(".prefork")
+    config.include(".debounce")
+    config.include(".batch")
+    config.include(".serializers")
+    config.include(".claimcheck")
+    config.include(".context")
+    config.include(".contextlocals")
+    config.include(".aio")
+    config.include(".executor")
+    config.include(".routing")
+    config.include(".sharding")
+    config.include(".mapping")
 
 
 def _get_app(registry):
@@ -68,7 +116,23 @@ def make_celery_app(config):
 
 def register_task(config, func, name=None, **kwargs):
     """
-    Register a new task with Celery.
+    Register a new task with Celery.  ``func`` may be an ``async def``
+    function.
+
+    """
+    if inspect.iscoroutinefunction(func):
+        make_handler = _make_async_task_handler
+    else:
+        make_handler = _make_task_handler
+    _add_task(config, func, name, kwargs, make_handler, mappable=True)
+
+
+def _add_task(config, func, name, options, make_handler, mappable=False):
+    """
+    Register ``func`` as a Celery task, wrapped by the task derivers and then
+    by the handler returned by ``make_handler(registry, derived)``.
+
+    If ``mappable`` is true, the task can also be used with ``defer_map``.
 
     """
     registry = config.registry
@@ -76,16 +140,27 @@ def register_task(config, func, name=None, **kwargs):
     name = name or app.gen_task_name(func.__name__, func.__module__)
 
     def register():
-        derived = apply_task_derivers(config, func, name, kwargs)
-        handler = _make_task_handler(config.registry, derived)
+        if registry["pyramid_tasks.lazy_derivation"]:
+            derived = apply_task_derivers_lazily(config, func, name, options)
+        else:
+            derived = apply_task_derivers(config, func, name, options)
+        handler = make_handler(config.registry, derived)
         task = app.task(
             handler,
             name=name,
             shared=False,
             bind=True,
-            **kwargs,
+            **options,
         )
         config.registry["pyramid_tasks.task_map"][func] = task
+        if mappable:
+            # Derive lazily, as few tasks are ever mapped.  Chunks are named
+            # separately, so their run times are not recorded as the task's.
+            registry["pyramid_tasks.map_funcs"][name] = (
+                apply_task_derivers_lazily(
+                    config, _make_map_func(func), f"{name}.chunk", options
+                )
+            )
 
     discriminator = ("register task", name)
     config.action(discriminator, register, order=PHASE1_CONFIG)
@@ -98,19 +173,87 @@ def _make_task_handler(registry, func):
 
     """
 
+    builder = get_request_builder(registry)
+    claim_check = get_claim_check(registry)
+
+    def handler(self, *args, **kwargs):
+        request = _make_task_request(builder, self)
+        if claim_check is not None:
+            args, kwargs = claim_check.resolve(
+                args, kwargs, get_offloaded(self)
+            )
+        with builder.prepare(request):
+            result = func(request, *args, **kwargs)
+        if claim_check is not None:
+            result = claim_check.offload_result(result)
+        return result
+
+    return handler
+
+
+def _make_async_task_handler(registry, func):
+    """
+    Like :func:`_make_task_handler`, but for ``async def`` tasks, which are
+    run to completion on the worker thread's persistent event loop.
+
+    """
+
+    builder = get_request_builder(registry)
+    claim_check = get_claim_check(registry)
+    registry["pyramid_tasks.async_tasks"] = True
+
     def handler(self, *args, **kwargs):
-        headers = self.request.headers
-        environ = headers.get("environ") if headers else None
-        request = _make_request(registry, environ)
-        with prepare(request=request, registry=registry):
-            return func(request, *args, **kwargs)
+        request = _make_task_request(builder, self)
+        if claim_check is not None:
+            args, kwargs = claim_check.resolve(
+                args, kwargs, get_offloaded(self)
+            )
+        with builder.prepare(request):
+            loop = aio.get_event_loop()
+            result = loop.run_until_complete(
+                aio.maybe_await(func(request, *args, **kwargs))
+            )
+        if claim_check is not None:
+            result = claim_check.offload_result(result)
+        return result
 
     return handler
 
 
-def _make_request(registry, environ):
-    request_factory = registry.queryUtility(IRequestFactory, default=Request)
-    request = request_factory.blank("/", environ=environ)
+def _make_map_func(func):
+    """
+    Return a function which calls ``func`` for each item in a chunk, for
+    ``defer_map``.
+
+    """
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def map_func(request, items):
+            return [await func(request, item) for item in items]
+
+    else:
+
+        @functools.wraps(func)
+        def map_func(request, items):
+            return [func(request, item) for item in items]
+
+    return map_func
+
+
+def _make_task_request(builder, task):
+    """
+    Create a request for the task currently being executed.
+
+    """
+    started = time.time()
+    headers = task.request.headers
+    environ = headers.get("environ") if headers else None
+    request = builder.make_request(environ)
+    request.environ["pyramid_tasks.started"] = started
+    context = headers.get(CONTEXT_HEADER) if headers else None
+    if context is not None:
+        request.environ[CONTEXT_ENVIRON_KEY] = context
     return request
 
 
@@ -168,8 +311,101 @@ def defer_task_with_options(
     be passed into the task.  Additional options will be passed into
     ``Task.apply_async``.  Please refer to Celery documentation to see options.
 
+    If ``after_commit`` is true and a transaction is active, the task will not
+    be queued until the transaction successfully commits.  It defaults to the
+    ``pyramid_tasks.after_commit`` setting.
+
+    If ``coalesce`` is true, identical calls made during the same request are
+    combined and the task is queued once when the request finishes.
+
+    If ``debounce`` is set to a number of seconds, the task is queued to run
+    after that many seconds, and identical calls made in the meantime by any
+    process are combined with it.  Calls are identical if ``debounce_key``,
+    called with the task's arguments, returns the same string.  By default,
+    all arguments are compared.  Both may also be passed to ``register_task``.
+
+    """
+    if options.pop("coalesce", False):
+        return _defer_coalesced(request, func_or_name, args, kwargs, options)
+    task = _get_task(request.registry, func_or_name)
+    debounce = options.pop("debounce", getattr(task, "debounce", None))
+    if debounce:
+        return _defer_debounced(
+            request, func_or_name, args, kwargs, options, debounce
+        )
+    deferral = _before_defer(request, func_or_name, args, kwargs, options)
+    return _dispatch(request, [deferral])[0]
+
+
+def defer_task_once(request, func_or_name, *args, **kwargs):
+    """
+    Add a task to the work queue once per request.  Calls with identical
+    arguments are combined, return the same ``AsyncResult`` and the task is
+    queued once the request finishes.  Convenience function for
+    ``defer_task_with_options`` with ``coalesce=True``.
+
+    """
+    return defer_task_with_options(
+        request,
+        func_or_name,
+        args=args,
+        kwargs=kwargs,
+        coalesce=True,
+    )
+
+
+def defer_tasks(request, calls):
+    """
+    Add many tasks to the work queue at once, publishing all of them with a
+    single producer.  ``calls`` is an iterable of tuples in the form of
+    ``(func_or_name, args, kwargs, options)``, where ``args``, ``kwargs`` and
+    ``options`` may be omitted.  Returns a list of ``AsyncResult`` objects in
+    the same order as ``calls``.
+
+    """
+    results = list()
+    positions = list()
+    deferrals = list()
+    for call in calls:
+        func_or_name, args, kwargs, options = _unpack_call(call)
+        task = _get_task(request.registry, func_or_name)
+        if (
+            options.get("coalesce")
+            or options.get("debounce")
+            or getattr(task, "debounce", None)
+        ):
+            results.append(
+                defer_task_with_options(
+                    request, func_or_name, args, kwargs, **options
+                )
+            )
+        else:
+            positions.append(len(results))
+            results.append(None)
+            deferrals.append(
+                _before_defer(request, func_or_name, args, kwargs, options)
+            )
+    for i, result in zip(positions, _dispatch(request, deferrals)):
+        results[i] = result
+    return results
+
+
+def _unpack_call(call):
+    func_or_name, args, kwargs, options = (tuple(call) + (None,) * 3)[:4]
+    return func_or_name, args or tuple(), kwargs, dict(options or ())
+
+
+def _before_defer(request, func_or_name, args, kwargs, options):
+    """
+    Look up the task and emit the ``BeforeDeferTask`` event.  Returns a tuple
+    of ``(task, args, kwargs, options)`` ready to be passed into
+    ``Task.apply_async``.
+
     """
     kwargs = kwargs if kwargs is not None else dict()
+    # Copy the options, which are modified before publishing, so a dictionary
+    # shared between calls is not changed.
+    options = dict(options)
     task = _get_task(request.registry, func_or_name)
     request.registry.notify(
         BeforeDeferTask(
@@ -180,16 +416,245 @@ def defer_task_with_options(
             options=options,
         )
     )
-    return task.apply_async(args, kwargs, **options)
+    add_context_header(request, options)
+    claim_check = get_claim_check(request.registry)
+    if claim_check is not None:
+        args, kwargs, offloaded = claim_check.offload(args, kwargs)
+        if offloaded is not None:
+            options["headers"] = dict(
+                options.get("headers") or (), **{CLAIM_CHECK_HEADER: offloaded}
+            )
+    return task, args, kwargs, options
+
+
+def _defer_coalesced(request, func_or_name, args, kwargs, options):
+    """
+    Defer a task unless an identical call has already been made during this
+    request, in which case return the existing ``AsyncResult``.
+
+    """
+    task = _get_task(request.registry, func_or_name)
+    key = json.dumps(
+        [task.name, args, kwargs, options], sort_keys=True, default=repr
+    )
+    coalesced = request.environ.setdefault("pyramid_tasks.coalesced", dict())
+    result = coalesced.get(key)
+    if result is None:
+        deferral = _before_defer(request, func_or_name, args, kwargs, options)
+        result = coalesced[key] = _dispatch(request, [deferral], hold=True)[0]
+    return result
+
+
+def _defer_debounced(request, func_or_name, args, kwargs, options, debounce):
+    """
+    Defer a task with a countdown of ``debounce`` seconds, unless an identical
+    call has been made in the last ``debounce`` seconds, in which case return
+    the ``AsyncResult`` of that call.
+
+    """
+    task = _get_task(request.registry, func_or_name)
+    kwargs = kwargs if kwargs is not None else dict()
+    # Celery sets task options as class attributes, so look up on the class to
+    # avoid getting a bound method.
+    key_func = options.pop(
+        "debounce_key", getattr(type(task), "debounce_key", None)
+    )
+    if key_func is not None:
+        key = key_func(*args, **kwargs)
+    else:
+        key = json.dumps([args, kwargs], sort_keys=True, default=repr)
+    task_id = uuid()
+    key = f"{task.name}:{key}"
+    store = get_debounce_store(request.registry)
+    existing = store.add(key, task_id, debounce)
+    if existing is not None:
+        return _get_result(request.registry, task, existing)
+    after_commit = options.get(
+        "after_commit", request.registry["pyramid_tasks.after_commit"]
+    )
+    transaction = _get_active_transaction(request) if after_commit else None
+    options["task_id"] = task_id
+    options.setdefault("countdown", debounce)
+    deferral = _before_defer(request, func_or_name, args, kwargs, options)
+    result = _dispatch(request, [deferral])[0]
+    if transaction is not None:
+        buffer = _get_commit_buffer(request.registry, transaction)
+
+        # The task is held until the transaction commits, so release the key
+        # if it is never published, otherwise identical calls would be
+        # dropped.  A readonly transaction publishes before aborting.
+        def release(success=False):
+            if not success and any(held is deferral for held in buffer):
+                store.discard(key, task_id)
+
+        transaction.addAfterCommitHook(release)
+        transaction.addAfterAbortHook(release)
+    return result
+
+
+def _dispatch(request, deferrals, hold=False):
+    """
+    Publish a list of ``(task, args, kwargs, options)`` tuples, holding back
+    any to be published after the current transaction commits.  Returns a list
+    of ``AsyncResult`` objects.
+
+    If ``hold`` is true, tasks not held for the transaction are held until the
+    request finishes.
+
+    """
+    default = request.registry["pyramid_tasks.after_commit"]
+    transaction = _marker
+    immediate = list()
+    results = list()
+    for deferral in deferrals:
+        task, _, _, options = deferral
+        after_commit = options.pop("after_commit", default)
+        if after_commit and transaction is _marker:
+            transaction = _get_active_transaction(request)
+        if after_commit and transaction is not None:
+            task_id = options.setdefault("task_id", uuid())
+            _get_commit_buffer(request.registry, transaction).append(deferral)
+            results.append(_get_result(request.registry, task, task_id))
+        elif hold:
+            task_id = options.setdefault("task_id", uuid())
+            _get_request_buffer(request).append(deferral)
+            results.append(_get_result(request.registry, task, task_id))
+        else:
+            immediate.append(len(results))
+            results.append(None)
+    published = _publish(request.registry, [deferrals[i] for i in immediate])
+    for i, result in zip(immediate, published):
+        results[i] = result
+    return results
+
+
+def _get_result(registry, task, task_id):
+    """
+    Get the result object for a task which has not been published yet.
+
+    """
+    executor = get_executor(registry)
+    if executor is not None:
+        return executor.result(task_id)
+    return task.AsyncResult(task_id)
+
+
+def _get_active_transaction(request):
+    """
+    Return the current transaction if one is being managed by pyramid_tm (or
+    by ``pyramid_tasks.contrib.pyramid_tm`` in a worker), otherwise ``None``.
+
+    """
+    environ = request.environ
+    if not environ.get("tm.active"):
+        return None
+    manager = environ.get("tm.manager")
+    if manager is None:
+        return None
+    try:
+        return manager.get()
+    except Exception:  # NoTransaction from an explicit manager
+        return None
+
+
+def _get_commit_buffer(registry, transaction):
+    """
+    Get the list of deferrals to be published when ``transaction`` commits,
+    registering the after-commit hook if this is the first.
+
+    """
+    try:
+        return transaction.data(registry)
+    except KeyError:
+        pass
+    buffer = list()
+
+    def hook(success):
+        if success:
+            _publish(registry, buffer)
+
+    transaction.set_data(registry, buffer)
+    transaction.addAfterCommitHook(hook)
+    return buffer
+
+
+def _publish_commit_buffer(registry, transaction):
+    """
+    Publish the deferrals held for ``transaction`` now, for a transaction
+    which is finished successfully without being committed.
+
+    """
+    try:
+        buffer = transaction.data(registry)
+    except KeyError:
+        return
+    deferrals = list(buffer)
+    buffer.clear()
+    _publish(registry, deferrals)
+
+
+def _get_request_buffer(request):
+    """
+    Get the list of deferrals to be published when the request finishes,
+    registering the finished callback if this is the first.
+
+    """
+    buffer = request.environ.get("pyramid_tasks.held")
+    if buffer is None:
+        buffer = request.environ["pyramid_tasks.held"] = list()
+        request.add_finished_callback(
+            lambda request: _publish(request.registry, buffer)
+        )
+    return buffer
+
+
+def _publish(registry, deferrals):
+    """
+    Publish a list of ``(task, args, kwargs, options)`` tuples using a single
+    producer.
+
+    """
+    if not deferrals:
+        return []
+    executor = get_executor(registry)
+    if executor is not None:
+        return [executor.submit(*deferral) for deferral in deferrals]
+    app = _get_app(registry)
+    results = list()
+    with app.producer_or_acquire() as producer:
+        for task, args, kwargs, options in deferrals:
+            options.setdefault("producer", producer)
+            results.append(task.apply_async(args, kwargs, **options))
+    return results
 
 
 def add_periodic_task(
-    config, schedule, func_or_name, args=(), kwargs=None, **opts
+    config,
+    schedule,
+    func_or_name,
+    args=(),
+    kwargs=None,
+    shards=None,
+    partition=None,
+    **opts,
 ):
     """
-    Add a period task.
+    Add a period task.  If ``shards`` or ``partition`` is set, the task is
+    fanned out into many shards on each tick.  See
+    :func:`pyramid_tasks.sharding.add_sharded_periodic_task`.
 
     """
+    if shards is not None or partition is not None:
+        config.add_sharded_periodic_task(
+            schedule,
+            func_or_name,
+            args,
+            kwargs,
+            shards=shards,
+            partition=partition,
+            **opts,
+        )
+        return
 
     def add():
         task = _get_task(config.registry, func_or_name)
@@ -204,20 +669,30 @@ def add_periodic_task(
     config.action(None, add, order=PHASE3_CONFIG)
 
 
-def get_task_result(request, task_id):
+def current_task(request):
     """
-    Get a result object from celery.
+    Return the task currently being executed.
 
     """
-    return _get_app(request.registry).AsyncResult(task_id)
+    return _get_app(request.registry).current_worker_task
 
 
-def current_task(request):
+def _connect_worker_init(registry):
     """
-    Return the task currently being executed.
+    Connect a signal handler to Celery's ``worker_init`` signal.
 
     """
-    return _get_app(request.registry).current_worker_task
+
+    def handler(sender=None, **kwargs):
+        enabled = registry.get("pyramid_tasks.prefork_preload")
+        if enabled:
+            prefork.preload(registry)
+        registry.notify(CeleryWorkerInit(registry))
+        if enabled:
+            prefork.freeze()
+
+    signal = celery.signals.worker_init
+    signal.connect(handler, weak=False)
 
 
 def _connect_worker_process_init(registry):
@@ -0,0 +1,78 @@
+"""
+Support for ``async def`` tasks.
+
+Async tasks are run on a long-lived event loop, so that resources bound to
+the loop, such as the connection pools of async HTTP and database clients,
+can be reused between tasks.  Each worker thread has its own loop, which is
+created in the ``CeleryWorkerProcessInit`` phase (or when first needed) and
+runs while a task is executing.
+
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+
+from celery import signals
+
+from .events import CeleryWorkerProcessInit
+
+_local = threading.local()
+
+
+def includeme(config):
+    config.registry["pyramid_tasks.async_tasks"] = False
+    config.add_subscriber(_on_worker_process_init, CeleryWorkerProcessInit)
+
+
+def _on_worker_process_init(event):
+    if event.registry["pyramid_tasks.async_tasks"]:
+        get_event_loop()
+        signals.worker_process_shutdown.connect(
+            _on_worker_process_shutdown, weak=False
+        )
+
+
+def _on_worker_process_shutdown(**kwargs):
+    close_event_loop()
+
+
+def get_event_loop():
+    """
+    Return the event loop for async tasks in the current thread, creating
+    it if necessary.  A loop inherited from a parent process is not reused.
+
+    """
+    loop = getattr(_local, "loop", None)
+    pid = os.getpid()
+    if loop is None or loop.is_closed() or _local.pid != pid:
+        loop = _local.loop = asyncio.new_event_loop()
+        _local.pid = pid
+    return loop
+
+
+def close_event_loop():
+    """
+    Close the event loop for the current thread, if any.
+
+    """
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed() or _local.pid != os.getpid():
+        return
+    try:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    finally:
+        loop.close()
+        _local.loop = None
+
+
+async def maybe_await(value):
+    """
+    Await ``value`` if it is awaitable, otherwise return it.  Allows
+    derivers to return a result without calling an async task.
+
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
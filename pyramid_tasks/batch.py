@@ -0,0 +1,254 @@
+"""
+Tasks which consume many deferrals in a single invocation.
+
+"""
+
+import inspect
+import logging
+import os
+import threading
+import time
+
+import celery
+
+from . import _add_task, aio
+from .claimcheck import get_claim_check, get_offloaded
+from .scripting import get_request_builder
+
+logger = logging.getLogger(__name__)
+
+
+def includeme(config):
+    config.registry["pyramid_tasks.batchers"] = list()
+    config.add_directive("register_batch_task", register_batch_task)
+
+
+def register_batch_task(
+    config,
+    func,
+    name=None,
+    flush_every=100,
+    flush_interval=1.0,
+    max_attempts=3,
+    max_buffered=10000,
+    **kwargs,
+):
+    """
+    Register a new batch task with Celery.
+
+    Each ``request.defer_task(func, item)`` is buffered by the worker process
+    that receives it.  Buffered items are delivered to ``func(request,
+    items)`` as a list once ``flush_every`` items have been received, once
+    the oldest item is ``flush_interval`` seconds old, or when the worker
+    process exits, whichever comes first.  Either limit may be ``None``, but
+    not both.
+
+    ``func`` may be an ``async def`` function, in which case it is run on the
+    thread's event loop.  If it raises, the items are buffered again and
+    delivered with the next batch, up to ``max_attempts`` times in all.  At
+    most ``max_buffered`` items are buffered; beyond that, the oldest are
+    dropped.
+
+    """
+    if flush_every is None and flush_interval is None:
+        raise ValueError("flush_every and flush_interval cannot both be None.")
+
+    def make_handler(registry, derived):
+        batcher = TaskBatcher(
+            registry,
+            derived,
+            flush_every,
+            flush_interval,
+            max_attempts=max_attempts,
+            max_buffered=max_buffered,
+            name=name or func.__qualname__,
+        )
+        batchers = registry["pyramid_tasks.batchers"]
+        if not batchers:
+            _connect_worker_shutdown(registry)
+        batchers.append(batcher)
+        if inspect.iscoroutinefunction(func):
+            registry["pyramid_tasks.async_tasks"] = True
+
+        claim_check = get_claim_check(registry)
+
+        def handler(self, item):
+            if claim_check is not None:
+                (item,), _ = claim_check.resolve(
+                    (item,), {}, get_offloaded(self)
+                )
+            batcher.add(item)
+
+        return handler
+
+    _add_task(config, func, name, kwargs, make_handler)
+
+
+class TaskBatcher:
+    """
+    Buffers the items deferred to a batch task within a worker process and
+    delivers them to the task in batches.
+
+    Items in a batch which fails are retried with the next batch, and dropped
+    once they have been delivered ``max_attempts`` times.  If more than
+    ``max_buffered`` items are buffered, the oldest are dropped.
+
+    """
+
+    def __init__(
+        self,
+        registry,
+        func,
+        flush_every,
+        flush_interval,
+        max_attempts=3,
+        max_buffered=None,
+        name=None,
+    ):
+        self.builder = get_request_builder(registry)
+        self.func = func
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.max_buffered = max_buffered
+        self.name = name
+        # A list of ``[item, attempts]`` pairs.
+        self._items = list()
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer_pid = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        """
+        Buffer ``item``, flushing in the calling thread if the batch is full.
+
+        """
+        with self._lock:
+            self._items.append([item, 0])
+            if len(self._items) == 1:
+                self._oldest = time.monotonic()
+            self._trim()
+            full = (
+                self.flush_every is not None
+                and len(self._items) >= self.flush_every
+            )
+        if full:
+            self.flush()
+        elif self.flush_interval is not None:
+            self._ensure_timer()
+
+    def flush(self):
+        """
+        Deliver all buffered items to the task.  Returns the task's result,
+        or ``None`` if nothing was buffered.  If the task raises, the items
+        which may be retried are buffered again before the exception is
+        raised.
+
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._items = self._items, list()
+                self._oldest = None
+            if not pending:
+                return None
+            try:
+                return self._deliver([item for item, _ in pending])
+            except BaseException:
+                retry = list()
+                for entry in pending:
+                    entry[1] += 1
+                    if entry[1] < self.max_attempts:
+                        retry.append(entry)
+                if len(retry) < len(pending):
+                    logger.error(
+                        "Dropping %d items from batch task %s after %d "
+                        "attempts.",
+                        len(pending) - len(retry),
+                        self.name,
+                        self.max_attempts,
+                    )
+                with self._lock:
+                    self._items[:0] = retry
+                    if self._items:
+                        # Wait another interval before the timer retries.
+                        self._oldest = time.monotonic()
+                    self._trim()
+                raise
+
+    def _trim(self):
+        """
+        Drop the oldest items beyond ``max_buffered``.  Must be called with
+        the lock held.
+
+        """
+        if self.max_buffered is None:
+            return
+        excess = len(self._items) - self.max_buffered
+        if excess > 0:
+            del self._items[:excess]
+            logger.error(
+                "Dropping %d items from batch task %s, which has more than "
+                "%d items buffered.",
+                excess,
+                self.name,
+                self.max_buffered,
+            )
+
+    def _deliver(self, items):
+        started = time.time()
+        request = self.builder.make_request()
+        request.environ["pyramid_tasks.started"] = started
+        with self.builder.prepare(request):
+            result = self.func(request, items)
+            if inspect.isawaitable(result):
+                result = aio.get_event_loop().run_until_complete(result)
+        return result
+
+    def _ensure_timer(self):
+        # Threads do not survive a fork, so each process starts its own.
+        pid = os.getpid()
+        if self._timer_pid == pid:
+            return
+        with self._lock:
+            if self._timer_pid == pid:
+                return
+            self._timer_pid = pid
+        thread = threading.Thread(target=self._run_timer, daemon=True)
+        thread.start()
+
+    def _run_timer(self):
+        while True:
+            with self._lock:
+                oldest = self._oldest
+            if oldest is None:
+                time.sleep(self.flush_interval)
+                continue
+            remaining = oldest + self.flush_interval - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing batch task.")
+
+
+def _connect_worker_shutdown(registry):
+    """
+    Flush any buffered items when a worker process exits.
+
+    """
+
+    def handler(sender=None, **kwargs):
+        for batcher in registry["pyramid_tasks.batchers"]:
+            try:
+                batcher.flush()
+            except Exception:
+                logger.exception("Error flushing batch task.")
+
+    celery.signals.worker_process_shutdown.connect(handler, weak=False)
+    celery.signals.worker_shutdown.connect(handler, weak=False)
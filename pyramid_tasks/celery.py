@@ -1,5 +1,7 @@
 from celery import Celery, signals
-from pyramid.paster import get_app
+from pyramid.config import Configurator
+from pyramid.paster import get_app, get_appsettings
+from pyramid.path import DottedNameResolver
 
 from . import set_global_app
 
@@ -39,5 +41,21 @@ def on_preload_parsed(options, **kwargs):
             options[key] = value
 
     set_global_app(celery)
-    # We don't do anything with this, just want to trigger configuration.
-    get_app(ini_location, options=options)
+    settings = get_appsettings(ini_location, options=options)
+    factory = settings.get("pyramid_tasks.worker_factory")
+    if factory is None:
+        # We don't do anything with this, just want to trigger configuration.
+        get_app(ini_location, options=options)
+    else:
+        factory = DottedNameResolver().maybe_resolve(factory)
+        config = factory(settings.global_conf, **settings)
+        config.make_celery_app()
+
+
+def configurator_from_settings(global_config, **settings):
+    """
+    A worker factory that creates a configurator from the settings alone.
+    Useful for applications configured entirely by ``pyramid.includes``.
+
+    """
+    return Configurator(settings=settings)
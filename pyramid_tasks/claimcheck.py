@@ -0,0 +1,273 @@
+"""
+Claim checks, which move large task arguments and results out of messages
+and into a blob store.
+
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import time
+
+from pyramid.exceptions import ConfigurationError
+from pyramid.path import DottedNameResolver
+
+REFERENCE = "__claim_check__"
+ESCAPE = "__claim_check_escaped__"
+HEADER = "pyramid_tasks_claim_checks"
+
+_KEY = re.compile(r"[0-9a-f]{64}")
+_KINDS = ("bytes", "str")
+
+_TYPES = (bytes, bytearray, memoryview, str)
+
+
+def includeme(config):
+    settings = config.get_settings()
+    threshold = int(settings.get("pyramid_tasks.claim_check.threshold", 0))
+    claim_check = None
+    if threshold > 0:
+        store = settings.get("pyramid_tasks.claim_check.store", "filesystem")
+        if store == "filesystem":
+            directory = settings.get("pyramid_tasks.claim_check.directory")
+            if not directory:
+                raise ConfigurationError(
+                    "pyramid_tasks.claim_check.directory must be set to use "
+                    "the filesystem blob store."
+                )
+            store = FilesystemBlobStore(directory)
+        else:
+            store = DottedNameResolver().maybe_resolve(store)(config.registry)
+        claim_check = ClaimCheck(store, threshold)
+        _install_result_class(config.registry, claim_check)
+    config.registry["pyramid_tasks.claim_check"] = claim_check
+
+
+def get_claim_check(registry):
+    """
+    Get the :class:`ClaimCheck` for the application, or ``None`` if claim
+    checks are disabled.
+
+    """
+    return registry["pyramid_tasks.claim_check"]
+
+
+class ClaimCheck:
+    """
+    Replaces ``bytes`` and ``str`` values longer than ``threshold`` with a
+    small reference to a copy in ``store``, and resolves those references
+    back again.
+
+    Resolved ``bytes`` are a read-only ``memoryview`` of the stored blob,
+    which the store may map into memory rather than read.  Resolved ``str``
+    values are decoded.
+
+    """
+
+    def __init__(self, store, threshold):
+        self.store = store
+        self.threshold = threshold
+
+    def offload(self, args, kwargs):
+        """
+        Offload any large values in ``args`` and ``kwargs``.  Only top-level
+        arguments are considered.
+
+        Returns ``(args, kwargs, offloaded)``, where ``offloaded`` records
+        which arguments were replaced by references, to be sent in the
+        :data:`HEADER` message header and passed to :meth:`resolve`.  It is
+        ``None`` if nothing was offloaded.
+
+        """
+        offloaded = {"args": [], "kwargs": []}
+        args = list(args)
+        for i, value in enumerate(args):
+            if self._should_offload(value):
+                args[i] = self.offload_value(value)
+                offloaded["args"].append(i)
+        kwargs = dict(kwargs)
+        for key, value in kwargs.items():
+            if self._should_offload(value):
+                kwargs[key] = self.offload_value(value)
+                offloaded["kwargs"].append(key)
+        if not offloaded["args"] and not offloaded["kwargs"]:
+            offloaded = None
+        args = tuple(args)
+        return args, kwargs, offloaded
+
+    def _should_offload(self, value):
+        return isinstance(value, _TYPES) and len(value) > self.threshold
+
+    def offload_value(self, value):
+        """
+        Return a reference to a copy of ``value`` in the store if it is
+        large, otherwise return ``value``.
+
+        """
+        if not self._should_offload(value):
+            return value
+        if isinstance(value, str):
+            kind, data = "str", value.encode("utf-8")
+        else:
+            kind, data = "bytes", value
+        return {REFERENCE: [kind, self.store.put(data)]}
+
+    def resolve(self, args, kwargs, offloaded):
+        """
+        Resolve the arguments listed in ``offloaded``, as returned by
+        :meth:`offload`.  Other arguments are never treated as references,
+        even if they look like one.
+
+        """
+        if not offloaded:
+            return args, kwargs
+        args = list(args)
+        for i in offloaded.get("args", ()):
+            if i < len(args):
+                args[i] = self.resolve_value(args[i])
+        kwargs = dict(kwargs)
+        for key in offloaded.get("kwargs", ()):
+            if key in kwargs:
+                kwargs[key] = self.resolve_value(kwargs[key])
+        return tuple(args), kwargs
+
+    def resolve_value(self, value):
+        """
+        Load the value a reference returned by :meth:`offload_value` refers
+        to.
+
+        """
+        if not _is_reference(value):
+            return value
+        kind, key = value[REFERENCE]
+        if kind not in _KINDS:
+            raise ValueError(f"Invalid claim check kind: {kind!r}")
+        data = self.store.open(key)
+        if kind == "str":
+            return str(data, "utf-8")
+        return data
+
+    def offload_result(self, value):
+        """
+        Offload a task's result if it is large.  Results which happen to look
+        like a reference are escaped, so they are not mistaken for one.
+
+        """
+        if _is_marked(value):
+            return {ESCAPE: value}
+        return self.offload_value(value)
+
+    def resolve_result(self, value):
+        """
+        Undo :meth:`offload_result`.
+
+        """
+        if _is_marked(value):
+            if ESCAPE in value:
+                return value[ESCAPE]
+            return self.resolve_value(value)
+        return value
+
+
+def get_offloaded(task):
+    """
+    Get the arguments offloaded for the task currently being executed.
+
+    """
+    headers = task.request.headers
+    return headers.get(HEADER) if headers else None
+
+
+def _is_marked(value):
+    return (
+        type(value) is dict
+        and len(value) == 1
+        and (REFERENCE in value or ESCAPE in value)
+    )
+
+
+def _is_reference(value):
+    return type(value) is dict and len(value) == 1 and REFERENCE in value
+
+
+class FilesystemBlobStore:
+    """
+    Stores blobs as files in ``directory``, which must be shared between the
+    processes deferring and running tasks (e.g. a shared volume).  Blobs are
+    named by the SHA-256 hash of their contents, so identical payloads are
+    only stored once.
+
+    Blobs are never deleted automatically.  Call :meth:`purge` periodically
+    to delete blobs older than any task could still need.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        if not isinstance(key, str) or not _KEY.fullmatch(key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.directory, key[:2], key)
+
+    def put(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if os.path.exists(path):
+            # Refresh the modification time so the blob is not purged.
+            os.utime(path)
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return key
+
+    def open(self, key):
+        """
+        Return a read-only ``memoryview`` of the blob, mapped into memory.
+
+        """
+        with open(self._path(key), "rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)
+
+    def purge(self, max_age):
+        """
+        Delete blobs last modified more than ``max_age`` seconds ago.
+
+        """
+        cutoff = time.time() - max_age
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+
+def _install_result_class(registry, claim_check):
+    """
+    Replace the Celery app's ``AsyncResult`` with a subclass which resolves
+    offloaded results.
+
+    """
+    app = registry["pyramid_tasks.app"]
+
+    class ClaimCheckAsyncResult(app.AsyncResult):
+        def _set_cache(self, d):
+            # Only called by Celery once the task is in a ready state.  ``d``
+            # may be shared with the backend's cache, so it is not modified.
+            d = dict(d, result=claim_check.resolve_result(d.get("result")))
+            return super()._set_cache(d)
+
+    app.AsyncResult = ClaimCheckAsyncResult
@@ -0,0 +1,135 @@
+"""
+Propagating context from the request deferring a task to the task's request.
+
+"""
+
+from collections.abc import Mapping
+
+from pyramid.settings import aslist
+
+HEADER = "pyramid_tasks_context"
+ENVIRON_KEY = "pyramid_tasks.context"
+
+_CAPTURED_KEY = "pyramid_tasks.captured_context"
+
+
+def _capture_traceparent(request):
+    return request.headers.get("traceparent")
+
+
+BUILTIN_PROPAGATORS = {
+    "user_id": lambda request: request.authenticated_userid,
+    "locale": lambda request: request.locale_name,
+    "host_url": lambda request: request.host_url,
+    "traceparent": _capture_traceparent,
+}
+
+
+def includeme(config):
+    config.registry["pyramid_tasks.context_propagators"] = dict()
+    config.add_directive(
+        "add_task_context_propagator", add_task_context_propagator
+    )
+    config.add_request_method(task_context, reify=True)
+    settings = config.get_settings()
+    for name in aslist(settings.get("pyramid_tasks.context", "")):
+        if name not in BUILTIN_PROPAGATORS:
+            raise ValueError(f"Unknown task context propagator: {name}")
+        config.add_task_context_propagator(name, BUILTIN_PROPAGATORS[name])
+
+
+def add_task_context_propagator(config, name, capture, restore=None):
+    """
+    Propagate a value from the request deferring a task to the task request.
+
+    ``capture(request)`` is called with the deferring request and must return
+    a value the task serializer supports, or ``None`` to propagate nothing.
+    In the task, the value is available as ``request.task_context[name]``.
+    If given, ``restore(request, value)`` is called with the task request the
+    first time the value is accessed, and its return value is used instead.
+
+    """
+    propagators = config.registry["pyramid_tasks.context_propagators"]
+
+    def register():
+        propagators[name] = (capture, restore)
+
+    config.action(("task context propagator", name), register)
+
+
+def capture_context(request):
+    """
+    Capture the context to propagate from ``request``, or ``None`` if there
+    is nothing to propagate.  The context is captured once per request.
+
+    """
+    environ = request.environ
+    if ENVIRON_KEY in environ:
+        # A task deferring another task passes on its own context.
+        return environ[ENVIRON_KEY]
+    if _CAPTURED_KEY in environ:
+        return environ[_CAPTURED_KEY]
+    propagators = request.registry["pyramid_tasks.context_propagators"]
+    context = dict()
+    for name, (capture, _) in propagators.items():
+        value = capture(request)
+        if value is not None:
+            context[name] = value
+    context = environ[_CAPTURED_KEY] = context or None
+    return context
+
+
+def add_context_header(request, options):
+    """
+    Add the propagated context of ``request`` to the headers in ``options``.
+
+    """
+    if not request.registry["pyramid_tasks.context_propagators"]:
+        return
+    context = capture_context(request)
+    if context is not None:
+        options["headers"] = dict(
+            options.get("headers") or (), **{HEADER: context}
+        )
+
+
+def task_context(request):
+    """
+    The context propagated from the request which deferred the task.
+
+    """
+    return TaskContext(request, request.environ.get(ENVIRON_KEY) or dict())
+
+
+class TaskContext(Mapping):
+    """
+    A read-only mapping of propagated values, which are restored on first
+    access.
+
+    """
+
+    def __init__(self, request, raw):
+        self._request = request
+        self._raw = raw
+        self._restored = dict()
+
+    def __getitem__(self, name):
+        try:
+            return self._restored[name]
+        except KeyError:
+            pass
+        value = self._raw[name]
+        propagators = self._request.registry[
+            "pyramid_tasks.context_propagators"
+        ]
+        restore = propagators.get(name, (None, None))[1]
+        if restore is not None:
+            value = restore(self._request, value)
+        self._restored[name] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
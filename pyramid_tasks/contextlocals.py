@@ -0,0 +1,132 @@
+"""
+Backs Pyramid's thread-local manager with context variables, so the current
+request and registry are isolated between greenlets as well as threads.
+
+"""
+
+import contextvars
+import threading
+import weakref
+
+from celery import concurrency, signals
+from pyramid import threadlocal
+from pyramid.settings import asbool
+
+_vars = weakref.WeakKeyDictionary()
+_vars_lock = threading.Lock()
+_originals = dict()
+_connected = False
+
+
+def includeme(config):
+    settings = config.get_settings()
+    value = settings.get("pyramid_tasks.contextvars", "auto")
+    if value == "auto":
+        _connect_worker_init()
+    elif asbool(value):
+        patch_threadlocal_manager()
+
+
+def _connect_worker_init():
+    global _connected
+    if _connected:
+        return
+
+    signals.worker_init.connect(_on_worker_init, weak=False)
+    _connected = True
+
+
+def _on_worker_init(sender=None, **kwargs):
+    """
+    Patch the thread-local manager if the worker uses a green pool, i.e.
+    gevent or eventlet.
+
+    """
+    pool_cls = getattr(sender, "pool_cls", None)
+    if pool_cls is None:
+        return
+    pool_cls = concurrency.get_implementation(pool_cls)
+    if getattr(pool_cls, "is_green", False):
+        patch_threadlocal_manager()
+
+
+def _get_var(manager):
+    var = _vars.get(manager)
+    if var is None:
+        with _vars_lock:
+            var = _vars.get(manager)
+            if var is None:
+                var = _vars[manager] = contextvars.ContextVar(
+                    "pyramid_tasks_threadlocal", default=()
+                )
+    return var
+
+
+def _push(self, info):
+    var = _get_var(self)
+    var.set((*var.get(), info))
+
+
+def _pop(self):
+    var = _get_var(self)
+    stack = var.get()
+    if stack:
+        var.set(stack[:-1])
+        return stack[-1]
+
+
+def _get(self):
+    stack = _get_var(self).get()
+    if stack:
+        return stack[-1]
+    return self.default()
+
+
+def _clear(self):
+    _get_var(self).set(())
+
+
+_METHODS = {
+    "push": _push,
+    "set": _push,
+    "pop": _pop,
+    "get": _get,
+    "clear": _clear,
+}
+
+
+def is_patched():
+    return bool(_originals)
+
+
+def patch_threadlocal_manager():
+    """
+    Replace the methods of :class:`pyramid.threadlocal.ThreadLocalManager`
+    so the stack is stored in a context variable rather than a thread-local.
+    Each thread, greenlet (with greenlet 1.0 or later) and asyncio task gets
+    its own stack.  Anything already pushed by the calling thread is kept.
+
+    """
+    if is_patched():
+        return
+    cls = threadlocal.ThreadLocalManager
+    stack = tuple(threadlocal.manager.stack)
+    for name, method in _METHODS.items():
+        _originals[name] = cls.__dict__[name]
+        setattr(cls, name, method)
+    _get_var(threadlocal.manager).set(stack)
+
+
+def unpatch_threadlocal_manager():
+    """
+    Undo :func:`patch_threadlocal_manager`.
+
+    """
+    if not is_patched():
+        return
+    stack = _get_var(threadlocal.manager).get()
+    cls = threadlocal.ThreadLocalManager
+    for name, method in _originals.items():
+        setattr(cls, name, method)
+    _originals.clear()
+    threadlocal.manager.stack[:] = list(stack)
@@ -0,0 +1,209 @@
+"""
+Attributes memory growth in the worker to the tasks which caused it.
+
+"""
+
+import logging
+import os
+import threading
+import tracemalloc
+
+from billiard.compat import mem_rss
+from pyramid.util import FIRST
+
+logger = logging.getLogger(__name__)
+
+
+def includeme(config):
+    settings = config.get_settings()
+    max_rss = settings.get("pyramid_tasks.memory.max_rss")
+    conf = config.registry["pyramid_tasks.app"].conf
+    if max_rss and not conf.worker_max_memory_per_child:
+        # Celery recycles the child once the task's result has been sent.
+        conf.worker_max_memory_per_child = int(max_rss)
+    config.registry["pyramid_tasks.memory"] = TaskMemory(
+        conf=conf,
+        top_allocations=int(
+            settings.get("pyramid_tasks.memory.tracemalloc", 0)
+        ),
+    )
+    config.add_task_deriver(memory_task_deriver, under=FIRST)
+
+
+def memory_task_deriver(task, info):
+    """
+    Record how much the peak resident memory of the process grows while
+    running the task.  Growth is charged to whichever task pushes the peak
+    higher, which is not necessarily the task that leaked the memory: a leak
+    only shows up once a later task needs memory beyond the previous peak.
+
+    """
+    memory = info.registry["pyramid_tasks.memory"]
+    name = info.name
+
+    def start():
+        snapshot = None
+        if memory.top_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot()
+        return get_max_rss(), snapshot
+
+    def finish(started):
+        before, snapshot = started
+        after = get_max_rss()
+        if before is None or after is None:
+            return
+        allocations = None
+        if snapshot is not None:
+            allocations = get_top_allocations(
+                snapshot, tracemalloc.take_snapshot(), memory.top_allocations
+            )
+        memory.observe(info.registry, name, after - before, after, allocations)
+
+    if info.is_async:
+
+        async def async_deriver(request, *args, **kwargs):
+            started = start()
+            try:
+                return await task(request, *args, **kwargs)
+            finally:
+                finish(started)
+
+        return async_deriver
+
+    def deriver(request, *args, **kwargs):
+        started = start()
+        try:
+            return task(request, *args, **kwargs)
+        finally:
+            finish(started)
+
+    return deriver
+
+
+def get_max_rss():
+    """
+    Return the peak resident memory of the current process in bytes, or
+    ``None`` if unavailable.  This is what the prefork pool compares against
+    ``worker_max_memory_per_child``.
+
+    """
+    try:
+        return int(mem_rss() * 1024)
+    except ImportError:
+        return None
+
+
+def get_top_allocations(before, after, limit):
+    """
+    Return a list of ``(location, size)`` tuples for the ``limit`` lines
+    whose allocated memory grew the most between two ``tracemalloc``
+    snapshots.
+
+    """
+    stats = after.compare_to(before, "lineno")
+    top = list()
+    for stat in stats[:limit]:
+        if stat.size_diff <= 0:
+            break
+        frame = stat.traceback[0]
+        top.append((f"{frame.filename}:{frame.lineno}", stat.size_diff))
+    return top
+
+
+class TaskMemoryStats:
+    """
+    The peak memory growth of a single task in the current process.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.growth = 0
+        self.max_growth = 0
+        self.allocations = None
+
+    def dump(self):
+        return {
+            "count": self.count,
+            "growth": self.growth,
+            "max_growth": self.max_growth,
+            "allocations": self.allocations,
+        }
+
+
+class TaskMemory:
+    """
+    Per-task growth of the peak memory of the current process.
+
+    If the peak resident memory exceeds ``worker_max_memory_per_child`` in
+    the Celery configuration ``conf`` after a task, the task is logged as
+    responsible, along with its largest allocations if ``top_allocations``
+    is set.
+
+    """
+
+    def __init__(self, conf=None, top_allocations=0):
+        self.conf = conf
+        self.top_allocations = top_allocations
+        self.tasks = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_rss(self):
+        """
+        The memory budget in bytes, or ``None``.
+
+        """
+        limit = getattr(self.conf, "worker_max_memory_per_child", None)
+        return limit * 1024 if limit else None
+
+    def observe(self, registry, name, delta, rss, allocations=None):
+        growth = max(delta, 0)
+        with self._lock:
+            stats = self.tasks.get(name)
+            if stats is None:
+                stats = self.tasks[name] = TaskMemoryStats()
+            stats.count += 1
+            stats.growth += growth
+            if growth >= stats.max_growth:
+                stats.max_growth = growth
+                if allocations is not None:
+                    stats.allocations = allocations
+        max_rss = self.max_rss
+        over = max_rss is not None and rss > max_rss
+        if over:
+            self.log_over_budget(name, delta, rss, max_rss, allocations)
+        metrics = registry.get("pyramid_tasks.metrics")
+        if metrics is not None:
+            metrics.add("memory_growth_bytes", name, growth)
+            if over:
+                metrics.add("memory_recycles", name, 1)
+                metrics.maybe_flush(force=True)
+
+    def log_over_budget(self, name, delta, rss, max_rss, allocations):
+        logger.warning(
+            "Worker process %s exceeded the memory budget after task %s "
+            "(peak grew by %.1fMiB to %.1fMiB, budget %.1fMiB) and will be "
+            "recycled",
+            os.getpid(),
+            name,
+            delta / 2**20,
+            rss / 2**20,
+            max_rss / 2**20,
+        )
+        for location, size in allocations or ():
+            logger.warning("  %.1fKiB allocated at %s", size / 2**10, location)
+
+    def snapshot(self):
+        """
+        Return a dictionary mapping task names to their peak memory growth,
+        with the tasks which grew the most first.
+
+        """
+        with self._lock:
+            items = sorted(
+                self.tasks.items(), key=lambda item: -item[1].growth
+            )
+            return {name: stats.dump() for name, stats in items}
@@ -0,0 +1,484 @@
+"""
+Collects per-task metrics and exposes them in the Prometheus text format.
+
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from celery import signals
+from celery.exceptions import Retry
+from pyramid.settings import aslist
+from pyramid.util import FIRST
+
+from ..events import BeforeDeferTask
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED_HEADER = "pyramid_tasks_published"
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+HISTOGRAMS = {
+    "queue_wait": "Time between publishing a task and it starting.",
+    "setup": "Time spent creating and preparing the task request.",
+    "run": "Time spent executing the task.",
+}
+
+TOTALS = {
+    "memory_growth_bytes": "Growth in resident memory while running the task.",
+    "memory_recycles": "Worker processes recycled after running the task.",
+}
+
+
+def includeme(config):
+    settings = config.get_settings()
+    buckets = settings.get("pyramid_tasks.metrics.buckets")
+    port = settings.get("pyramid_tasks.metrics.port")
+    metrics = TaskMetrics(
+        buckets=[float(x) for x in aslist(buckets)] if buckets else None,
+        directory=settings.get("pyramid_tasks.metrics.directory"),
+        flush_interval=float(
+            settings.get("pyramid_tasks.metrics.flush_interval", 5.0)
+        ),
+    )
+    config.registry["pyramid_tasks.metrics"] = metrics
+    config.add_subscriber(stamp_published, BeforeDeferTask)
+    config.add_task_deriver(metrics_task_deriver, under=FIRST)
+    _connect_worker_signals(
+        metrics,
+        host=settings.get("pyramid_tasks.metrics.host", "127.0.0.1"),
+        port=int(port) if port else None,
+        textfile=settings.get("pyramid_tasks.metrics.textfile"),
+    )
+
+
+def stamp_published(event):
+    """
+    Add the time of publishing to the task headers, so the queue wait can be
+    measured.
+
+    """
+    # Copy the headers, which may be shared between calls.
+    headers = dict(event.options.get("headers") or ())
+    headers.setdefault(PUBLISHED_HEADER, time.time())
+    event.options["headers"] = headers
+
+
+def metrics_task_deriver(task, info):
+    metrics = info.registry["pyramid_tasks.metrics"]
+    name = info.name
+
+    def start(request):
+        started = time.time()
+        handler_started = request.environ.get("pyramid_tasks.started")
+        if handler_started is not None:
+            metrics.observe("setup", name, started - handler_started)
+            published = _get_published(request)
+            if published is not None:
+                wait = handler_started - published
+                metrics.observe("queue_wait", name, max(wait, 0.0))
+        return started
+
+    def finish(started, outcome):
+        metrics.observe("run", name, time.time() - started)
+        metrics.increment(name, outcome)
+        metrics.maybe_flush()
+
+    if info.is_async:
+
+        async def async_deriver(request, *args, **kwargs):
+            started = start(request)
+            outcome = "failure"
+            try:
+                result = await task(request, *args, **kwargs)
+                outcome = "success"
+                return result
+            except Retry:
+                outcome = "retry"
+                raise
+            finally:
+                finish(started, outcome)
+
+        return async_deriver
+
+    def deriver(request, *args, **kwargs):
+        started = start(request)
+        outcome = "failure"
+        try:
+            result = task(request, *args, **kwargs)
+            outcome = "success"
+            return result
+        except Retry:
+            outcome = "retry"
+            raise
+        finally:
+            finish(started, outcome)
+
+    return deriver
+
+
+def _get_published(request):
+    current = request.current_task
+    if current is None:
+        return None
+    published = getattr(current.request, PUBLISHED_HEADER, None)
+    return float(published) if published is not None else None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def dump(self):
+        return {"counts": self.counts, "sum": self.sum}
+
+
+class TaskMetrics:
+    """
+    Task metrics for the current process.
+
+    If ``directory`` is set, a snapshot is written to a file named after the
+    process ID every ``flush_interval`` seconds.  :meth:`collect`
+    merges every snapshot in the directory, so metrics from all prefork
+    children are aggregated.
+
+    """
+
+    def __init__(self, buckets=None, directory=None, flush_interval=5.0):
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.histograms = {metric: dict() for metric in HISTOGRAMS}
+        self.counters = dict()
+        self.totals = dict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer_pid = None
+
+    def observe(self, metric, task_name, value):
+        with self._lock:
+            histograms = self.histograms[metric]
+            histogram = histograms.get(task_name)
+            if histogram is None:
+                histogram = histograms[task_name] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, task_name, outcome):
+        key = (task_name, outcome)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def add(self, metric, task_name, value):
+        """
+        Add ``value`` to a running total, such as ``memory_growth_bytes``.
+
+        """
+        key = (metric, task_name)
+        with self._lock:
+            self.totals[key] = self.totals.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "histograms": {
+                    metric: {
+                        name: histogram.dump()
+                        for name, histogram in histograms.items()
+                    }
+                    for metric, histograms in self.histograms.items()
+                },
+                "counters": [
+                    [name, outcome, count]
+                    for (name, outcome), count in self.counters.items()
+                ],
+                "totals": [
+                    [metric, name, value]
+                    for (metric, name), value in self.totals.items()
+                ],
+            }
+
+    def maybe_flush(self, force=False):
+        """
+        Flush if ``flush_interval`` seconds have passed since the last flush,
+        or if ``force`` is true.  Errors are logged rather than raised, so
+        they do not fail the task.
+
+        """
+        if self.directory is None:
+            return
+        elapsed = time.monotonic() - self._last_flush
+        if force or elapsed >= self.flush_interval:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing task metrics.")
+
+    def flush(self):
+        """
+        Write this process's snapshot to the metrics directory.
+
+        """
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(self.snapshot(), fh)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def start_timer(self):
+        """
+        Flush every ``flush_interval`` seconds in a background thread, so the
+        snapshot stays current while the process is idle.
+
+        """
+        if self.directory is None:
+            return
+        # Threads do not survive a fork, so each process starts its own.
+        pid = os.getpid()
+        with self._lock:
+            if self._timer_pid == pid:
+                return
+            self._timer_pid = pid
+        thread = threading.Thread(target=self._run_timer, daemon=True)
+        thread.start()
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing task metrics.")
+
+    def clear_directory(self):
+        """
+        Remove snapshots left over from previous runs.
+
+        """
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(self.directory, filename))
+
+    def collect(self):
+        """
+        Return a snapshot merging all processes, or just this process if no
+        directory is configured.
+
+        """
+        if self.directory is None:
+            return self.snapshot()
+        self.flush()
+        snapshots = list()
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as fh:
+                    snapshots.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+        return merge_snapshots(snapshots, self.buckets)
+
+    def render(self):
+        """
+        Render the collected metrics in the Prometheus text format.
+
+        """
+        return render_snapshot(self.collect())
+
+
+def merge_snapshots(snapshots, buckets):
+    merged = {
+        "buckets": list(buckets),
+        "histograms": {metric: dict() for metric in HISTOGRAMS},
+        "counters": [],
+        "totals": [],
+    }
+    counters = dict()
+    totals = dict()
+    for snapshot in snapshots:
+        for metric, histograms in snapshot["histograms"].items():
+            target = merged["histograms"].setdefault(metric, dict())
+            for name, data in histograms.items():
+                if name not in target:
+                    target[name] = {"counts": list(data["counts"]), "sum": 0}
+                else:
+                    counts = target[name]["counts"]
+                    for i, count in enumerate(data["counts"]):
+                        counts[i] += count
+                target[name]["sum"] += data["sum"]
+        for name, outcome, count in snapshot["counters"]:
+            counters[(name, outcome)] = (
+                counters.get((name, outcome), 0) + count
+            )
+        for metric, name, value in snapshot.get("totals", ()):
+            totals[(metric, name)] = totals.get((metric, name), 0) + value
+    merged["counters"] = [
+        [name, outcome, count] for (name, outcome), count in counters.items()
+    ]
+    merged["totals"] = [
+        [metric, name, value] for (metric, name), value in totals.items()
+    ]
+    return merged
+
+
+def render_snapshot(snapshot):
+    lines = list()
+    bounds = [_format_float(b) for b in snapshot["buckets"]] + ["+Inf"]
+    for metric, histograms in snapshot["histograms"].items():
+        full_name = f"pyramid_tasks_{metric}_seconds"
+        lines.append(f"# HELP {full_name} {HISTOGRAMS.get(metric, '')}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for name in sorted(histograms):
+            data = histograms[name]
+            task = _escape(name)
+            cumulative = 0
+            for bound, count in zip(bounds, data["counts"]):
+                cumulative += count
+                lines.append(
+                    f'{full_name}_bucket{{task="{task}",le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f'{full_name}_sum{{task="{task}"}} {data["sum"]}')
+            lines.append(f'{full_name}_count{{task="{task}"}} {cumulative}')
+    lines.append("# HELP pyramid_tasks_completed_total Tasks completed.")
+    lines.append("# TYPE pyramid_tasks_completed_total counter")
+    for name, outcome, count in sorted(snapshot["counters"]):
+        lines.append(
+            "pyramid_tasks_completed_total"
+            f'{{task="{_escape(name)}",outcome="{outcome}"}} {count}'
+        )
+    totals = dict()
+    for metric, name, value in snapshot.get("totals", ()):
+        totals.setdefault(metric, dict())[name] = value
+    for metric in sorted(totals):
+        full_name = f"pyramid_tasks_{metric}_total"
+        lines.append(f"# HELP {full_name} {TOTALS.get(metric, '')}")
+        lines.append(f"# TYPE {full_name} counter")
+        for name, value in sorted(totals[metric].items()):
+            lines.append(f'{full_name}{{task="{_escape(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def _format_float(value):
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def serve(metrics, host, port):
+    """
+    Serve the metrics over HTTP in a background thread.
+
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def write_textfile(metrics, path):
+    """
+    Write the metrics to ``path``, e.g. for node_exporter's textfile
+    collector.
+
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as fh:
+        fh.write(metrics.render())
+    os.replace(tmp, path)
+
+
+def _write_textfile_forever(metrics, path):
+    def run():
+        while True:
+            write_textfile(metrics, path)
+            time.sleep(metrics.flush_interval)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _connect_worker_signals(metrics, host, port, textfile):
+    """
+    Clear stale snapshots when the worker starts, start exporting once the
+    worker is ready, flush periodically in each child process, and flush when
+    a child process exits.
+
+    """
+
+    def on_init(**kwargs):
+        metrics.clear_directory()
+
+    def on_process_init(**kwargs):
+        metrics.start_timer()
+
+    def on_ready(**kwargs):
+        if port is not None:
+            serve(metrics, host, port)
+        if textfile is not None:
+            _write_textfile_forever(metrics, textfile)
+
+    def on_shutdown(**kwargs):
+        metrics.flush()
+
+    signals.worker_init.connect(on_init, weak=False)
+    signals.worker_ready.connect(on_ready, weak=False)
+    signals.worker_process_init.connect(on_process_init, weak=False)
+    signals.worker_process_shutdown.connect(on_shutdown, weak=False)
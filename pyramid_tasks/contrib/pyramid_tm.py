@@ -3,22 +3,98 @@ Emulates ``pyramid_tm`` functionality inside of Celery.
 
 """
 
+from .. import _publish_commit_buffer
+
 
 def includeme(config):
     config.add_task_deriver(transaction_task_deriver)
 
 
 def transaction_task_deriver(task, info):
+    """
+    Run the task within a transaction.
+
+    The transaction is retried in-process up to ``tm_attempts`` times (a task
+    option, defaulting to the ``pyramid_tasks.tm.attempts`` setting, or 1) if
+    it fails with a retryable error, using ``manager.attempts``.  Tasks
+    registered with ``readonly=True`` have their transaction aborted rather
+    than committed, and tasks they deferred with ``after_commit`` are
+    published if they succeed.
+
+    """
+    settings = info.registry.settings or dict()
+    # pyramid_tm's tm.attempts is not used, so that existing applications do
+    # not start retrying tasks unexpectedly.
+    attempts = int(
+        info.options.get(
+            "tm_attempts", settings.get("pyramid_tasks.tm.attempts", 1)
+        )
+    )
+    readonly = info.options.get("readonly", False)
+
+    if info.is_async:
+
+        async def async_deriver(request, *args, **kwargs):
+            manager = _activate(request)
+            if manager is None:
+                return await task(request, *args, **kwargs)
+
+            if readonly:
+                txn = manager.begin()
+                try:
+                    result = await task(request, *args, **kwargs)
+                    _publish_commit_buffer(request.registry, txn)
+                    return result
+                finally:
+                    manager.abort()
+
+            if attempts == 1:
+                with manager:
+                    return await task(request, *args, **kwargs)
+
+            for attempt in manager.attempts(attempts):
+                with attempt:
+                    result = await task(request, *args, **kwargs)
+            return result
+
+        return async_deriver
+
     def deriver(request, *args, **kwargs):
-        environ = request.environ
-        if environ.get("tm.active"):
+        manager = _activate(request)
+        if manager is None:
             return task(request, *args, **kwargs)
 
-        manager = request.tm
-        environ["tm.active"] = True
-        environ["tm.manager"] = manager
+        if readonly:
+            txn = manager.begin()
+            try:
+                result = task(request, *args, **kwargs)
+                _publish_commit_buffer(request.registry, txn)
+                return result
+            finally:
+                manager.abort()
 
-        with manager:
-            return task(request, *args, **kwargs)
+        if attempts == 1:
+            with manager:
+                return task(request, *args, **kwargs)
+
+        for attempt in manager.attempts(attempts):
+            with attempt:
+                result = task(request, *args, **kwargs)
+        return result
 
     return deriver
+
+
+def _activate(request):
+    """
+    Mark the transaction as active and return the transaction manager, or
+    return ``None`` if a transaction is already active.
+
+    """
+    environ = request.environ
+    if environ.get("tm.active"):
+        return None
+    manager = request.tm
+    environ["tm.active"] = True
+    environ["tm.manager"] = manager
+    return manager
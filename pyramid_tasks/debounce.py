@@ -0,0 +1,121 @@
+"""
+Stores for coordinating debounced tasks between processes.
+
+"""
+
+import json
+import threading
+import time
+
+from pyramid.path import DottedNameResolver
+
+
+def includeme(config):
+    settings = config.get_settings()
+    store = settings.get("pyramid_tasks.debounce_store", "backend")
+    if store == "backend":
+        store = BackendDebounceStore(config.registry)
+    elif store == "memory":
+        store = MemoryDebounceStore()
+    else:
+        store = DottedNameResolver().maybe_resolve(store)(config.registry)
+    config.registry["pyramid_tasks.debounce_store"] = store
+
+
+def get_debounce_store(registry):
+    return registry["pyramid_tasks.debounce_store"]
+
+
+class MemoryDebounceStore:
+    """
+    Stores debounce state in memory.  Only suitable for testing or when all
+    tasks are deferred from a single process.
+
+    """
+
+    def __init__(self):
+        self._data = dict()
+        self._lock = threading.Lock()
+
+    def add(self, key, value, ttl):
+        """
+        Set ``key`` to ``value`` for ``ttl`` seconds unless it is already set.
+        Returns the existing value if set, otherwise ``None``.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            existing = self._data.get(key)
+            if existing is not None and existing[0] > now:
+                return existing[1]
+            self._data[key] = (now + ttl, value)
+            return None
+
+    def discard(self, key, value):
+        """
+        Remove ``key`` if it is set to ``value``.
+
+        """
+        with self._lock:
+            existing = self._data.get(key)
+            if existing is not None and existing[1] == value:
+                del self._data[key]
+
+
+class BackendDebounceStore:
+    """
+    Stores debounce state in Celery's result backend, which must be a
+    key/value store such as Redis or Memcached.  With Redis, keys are set
+    atomically.  Other backends read and then write, so concurrent deferrals
+    may occasionally both be queued.
+
+    """
+
+    prefix = "pyramid-tasks-debounce-"
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    @property
+    def backend(self):
+        return self.registry["pyramid_tasks.app"].backend
+
+    def _get_backend(self):
+        backend = self.backend
+        if not hasattr(backend, "get_key_for_task"):
+            raise NotImplementedError(
+                "Debouncing requires a key/value result backend."
+            )
+        return backend
+
+    def add(self, key, value, ttl):
+        backend = self._get_backend()
+        key = backend.key_t(self.prefix + key)
+        expires = time.time() + ttl
+        encoded = json.dumps({"value": value, "expires": expires})
+        if _is_redis(backend):
+            ms = max(int(ttl * 1000), 1)
+            if backend.client.set(key, encoded, nx=True, px=ms):
+                return None
+        existing = backend.get(key)
+        if existing:
+            existing = json.loads(existing)
+            if existing["expires"] > time.time():
+                return existing["value"]
+        backend.set(key, encoded)
+        return None
+
+    def discard(self, key, value):
+        backend = self._get_backend()
+        key = backend.key_t(self.prefix + key)
+        existing = backend.get(key)
+        if existing and json.loads(existing)["value"] == value:
+            backend.delete(key)
+
+
+def _is_redis(backend):
+    try:
+        from celery.backends.redis import RedisBackend
+    except ImportError:
+        return False
+    return isinstance(backend, RedisBackend)
@@ -23,6 +23,22 @@ class BeforeDeferTask:
         """The additional options being passed in to ``Task.apply_async``."""
 
 
+class CeleryWorkerInit:
+    """
+    This event is emitted by Celery's ``worker_init`` signal, before the
+    worker's pool is started.  When using the prefork pool, this is emitted in
+    the parent process before forking, so it is a good place to load anything
+    the child processes will need.
+
+    See more:  https://docs.celeryq.dev/en/stable/userguide/signals.html
+
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        """The current Pyramid registry."""
+
+
 class CeleryWorkerProcessInit:
     """
     This is event is emitted Celery's ``worker_process_init`` signal.  Useful
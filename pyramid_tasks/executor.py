@@ -0,0 +1,254 @@
+"""
+Running tasks in a local thread pool rather than sending them to a broker.
+
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from celery import states
+from celery.exceptions import TimeoutError
+from celery.utils import uuid
+from pyramid.exceptions import ConfigurationError
+
+from .claimcheck import get_claim_check
+
+
+def includeme(config):
+    settings = config.get_settings()
+    name = settings.get("pyramid_tasks.executor", "celery")
+    if name == "celery":
+        executor = None
+    elif name == "local":
+        executor = LocalExecutor(
+            max_workers=int(
+                settings.get("pyramid_tasks.executor.max_workers", 4)
+            ),
+            max_pending=int(
+                settings.get("pyramid_tasks.executor.max_pending", 1000)
+            ),
+            max_results=int(
+                settings.get("pyramid_tasks.executor.max_results", 10000)
+            ),
+            result_ttl=float(
+                settings.get("pyramid_tasks.executor.result_ttl", 3600)
+            ),
+            claim_check=get_claim_check(config.registry),
+        )
+    else:
+        raise ConfigurationError(f"Unknown task executor: {name}")
+    config.registry["pyramid_tasks.executor"] = executor
+
+
+def get_executor(registry):
+    """
+    Get the :class:`LocalExecutor` for the application, or ``None`` if tasks
+    are sent to Celery.
+
+    """
+    return registry["pyramid_tasks.executor"]
+
+
+class LocalExecutor:
+    """
+    Runs tasks in a bounded pool of threads in the current process.  Tasks
+    are run with ``Task.apply``, so the task request is created just as it is
+    by a worker.
+
+    At most ``max_pending`` tasks may be queued or running at once.  Once the
+    limit is reached, deferring a task blocks until another task finishes.
+
+    Results are kept so they can be looked up by task ID, for ``result_ttl``
+    seconds after the task finishes.  At most ``max_results`` are kept, and
+    the least recently used are discarded first.
+
+    """
+
+    def __init__(
+        self,
+        max_workers=4,
+        max_pending=1000,
+        max_results=10000,
+        result_ttl=3600,
+        claim_check=None,
+    ):
+        self.max_workers = max_workers
+        self.max_results = max_results
+        self.result_ttl = result_ttl
+        self.claim_check = claim_check
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+
+    def _get_pool(self):
+        # Threads do not survive a fork, so each process needs its own pool.
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pool = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="pyramid_tasks"
+                    )
+                    self._pid = pid
+        return self._pool
+
+    def result(self, task_id):
+        """
+        Get the :class:`LocalResult` for ``task_id``.  Unknown or expired
+        tasks are ``PENDING``, as with Celery.
+
+        """
+        with self._lock:
+            entry = self._results.get(task_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._results.move_to_end(task_id)
+                return entry[1]
+            result = LocalResult(task_id)
+            self._keep(result)
+        return result
+
+    def _keep(self, result):
+        """
+        Keep ``result`` for another ``result_ttl`` seconds.  Must be called
+        with the lock held.
+
+        """
+        self._results[result.id] = (time.monotonic() + self.result_ttl, result)
+        self._results.move_to_end(result.id)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def submit(self, task, args, kwargs, options):
+        """
+        Queue a task.  ``countdown`` and ``eta`` are honored; other
+        ``apply_async`` options besides ``task_id`` and ``headers`` are
+        ignored.
+
+        """
+        result = self.result(options.get("task_id") or uuid())
+        self._slots.acquire()
+        delay = _get_delay(options)
+        call = (task, args, kwargs, options.get("headers"), result)
+        if delay > 0:
+            timer = threading.Timer(delay, self._submit, call)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._submit(*call)
+        return result
+
+    def _submit(self, *call):
+        try:
+            self._get_pool().submit(self._run, *call)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _run(self, task, args, kwargs, headers, result):
+        try:
+            result._set(states.STARTED)
+            eager = task.apply(
+                args, kwargs, task_id=result.id, headers=headers, throw=False
+            )
+            value = eager.result
+            if self.claim_check is not None and eager.state == states.SUCCESS:
+                value = self.claim_check.resolve_result(value)
+            result._set(eager.state, value, eager.traceback)
+        except BaseException as exc:
+            result._set(states.FAILURE, exc)
+            raise
+        finally:
+            with self._lock:
+                # The result may have expired while the task was running.
+                self._keep(result)
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=wait)
+            self._pid = None
+
+
+def _get_delay(options):
+    countdown = options.get("countdown")
+    if countdown is not None:
+        return float(countdown)
+    eta = options.get("eta")
+    if eta is None:
+        return 0.0
+    if isinstance(eta, str):
+        eta = datetime.fromisoformat(eta)
+    if eta.tzinfo is None:
+        eta = eta.replace(tzinfo=timezone.utc)
+    return (eta - datetime.now(timezone.utc)).total_seconds()
+
+
+class LocalResult:
+    """
+    The result of a task run by :class:`LocalExecutor`.  Supports the
+    commonly-used parts of Celery's ``AsyncResult`` interface.
+
+    """
+
+    def __init__(self, task_id):
+        self.id = task_id
+        self.state = states.PENDING
+        self.traceback = None
+        self._result = None
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return f"<LocalResult: {self.id}>"
+
+    @property
+    def task_id(self):
+        return self.id
+
+    @property
+    def status(self):
+        return self.state
+
+    @property
+    def result(self):
+        return self._result
+
+    info = result
+
+    def ready(self):
+        return self.state in states.READY_STATES
+
+    def successful(self):
+        return self.state == states.SUCCESS
+
+    def failed(self):
+        return self.state == states.FAILURE
+
+    def get(self, timeout=None, propagate=True, **kwargs):
+        """
+        Wait until the task is finished and return its result, or raise its
+        exception if ``propagate`` is true.
+
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("The operation timed out.")
+        if propagate and self.state in states.PROPAGATE_STATES:
+            raise self._result
+        return self._result
+
+    wait = get
+
+    def forget(self):
+        pass
+
+    def _set(self, state, result=None, traceback=None):
+        self._result = result
+        self.traceback = traceback
+        self.state = state
+        if state in states.READY_STATES:
+            self._done.set()
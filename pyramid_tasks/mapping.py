@@ -0,0 +1,140 @@
+"""
+Deferring a task for every item of an iterable, in chunks.
+
+"""
+
+import collections
+import inspect
+import itertools
+
+from pyramid.interfaces import PHASE1_CONFIG
+
+from . import _get_task, _make_task_request, aio, defer_task_with_options
+from .scripting import get_request_builder
+
+MAP_TASK = "pyramid_tasks.map_chunk"
+
+# The task attributes which ``Task.apply_async`` uses as default options.
+EXEC_OPTIONS = (
+    "queue",
+    "routing_key",
+    "exchange",
+    "priority",
+    "expires",
+    "serializer",
+    "delivery_mode",
+    "compression",
+    "time_limit",
+    "soft_time_limit",
+)
+
+
+def includeme(config):
+    registry = config.registry
+    registry["pyramid_tasks.map_funcs"] = dict()
+    config.add_request_method(defer_map)
+
+    def register():
+        app = registry["pyramid_tasks.app"]
+        app.task(
+            _make_chunk_handler(registry),
+            name=MAP_TASK,
+            shared=False,
+            bind=True,
+        )
+
+    config.action(("register task", MAP_TASK), register, order=PHASE1_CONFIG)
+
+
+def _make_chunk_handler(registry):
+    """
+    Return a task handler which calls a task for each item in a chunk, all
+    with the same request.  The task derivers are applied once per chunk.
+
+    """
+    builder = get_request_builder(registry)
+    map_funcs = registry["pyramid_tasks.map_funcs"]
+
+    def handler(self, name, items):
+        func = map_funcs[name]
+        request = _make_task_request(builder, self)
+        with builder.prepare(request):
+            result = func(request, items)
+            if inspect.isawaitable(result):
+                result = aio.get_event_loop().run_until_complete(result)
+        return result
+
+    return handler
+
+
+def defer_map(
+    request,
+    func_or_name,
+    iterable,
+    chunk_size=100,
+    max_in_flight=None,
+    **options,
+):
+    """
+    Defer a task for each item in ``iterable``, which is consumed lazily.
+    Items are sent in chunks of up to ``chunk_size``, and the worker runs the
+    task for each item in a chunk with the same request, as
+    ``func(request, item)``.  Returns a list of ``AsyncResult`` objects, one
+    per chunk, whose results are lists of the task's results.
+
+    If ``max_in_flight`` is set, no more than that many chunks are
+    outstanding at once; deferring another waits for the oldest to finish.
+    This requires a result backend, and chunks are not held until the
+    transaction commits.  Additional options will be passed into
+    ``Task.apply_async``.  Chunks are sent with the options the task was
+    registered with, such as ``queue`` and ``time_limit``, and routed as the
+    task would be.
+
+    """
+    registry = request.registry
+    task = _get_task(registry, func_or_name)
+    if task.name not in registry["pyramid_tasks.map_funcs"]:
+        raise ValueError(f"Task cannot be mapped: {task.name}")
+    options = _get_map_options(registry["pyramid_tasks.app"], task, options)
+    if max_in_flight is not None:
+        options["after_commit"] = False
+    iterator = iter(iterable)
+    in_flight = collections.deque()
+    results = list()
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            break
+        if max_in_flight is not None:
+            while len(in_flight) >= max_in_flight:
+                in_flight.popleft().get(
+                    propagate=False, disable_sync_subtasks=False
+                )
+        result = defer_task_with_options(
+            request, MAP_TASK, args=(task.name, chunk), **dict(options)
+        )
+        results.append(result)
+        if max_in_flight is not None:
+            in_flight.append(result)
+    return results
+
+
+def _get_map_options(app, task, options):
+    """
+    Return the options for sending chunks of ``task``: its execution options
+    and route, overridden by ``options``, as ``Task.apply_async`` would do
+    for the task itself.
+
+    """
+    merged = dict()
+    for key in EXEC_OPTIONS:
+        value = getattr(task, key, None)
+        if value is not None:
+            merged[key] = value
+    merged.update(options)
+    router = app.amqp.router
+    if router.routes:
+        route = router.lookup_route(task.name, (), {}, merged, None)
+        if route:
+            merged = dict(route, **merged)
+    return merged
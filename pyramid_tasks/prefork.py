@@ -0,0 +1,98 @@
+"""
+Preparing the worker for Celery's prefork pool, so that memory is shared
+between the parent and child processes for as long as possible.
+
+"""
+
+import gc
+import logging
+import os
+
+from celery import signals
+from pyramid.settings import asbool
+
+from .scripting import get_request_builder
+
+logger = logging.getLogger(__name__)
+
+SMAPS_ROLLUP = "/proc/self/smaps_rollup"
+
+
+def includeme(config):
+    settings = config.get_settings()
+    enabled = asbool(settings.get("pyramid_tasks.prefork_preload", False))
+    config.registry["pyramid_tasks.prefork_preload"] = enabled
+    if enabled:
+        _connect_child_signals()
+
+
+def preload(registry):
+    """
+    Load everything the worker will need before the pool forks.
+
+    """
+    app = registry["pyramid_tasks.app"]
+    app.loader.import_default_modules()
+    get_request_builder(registry)._resolve()
+
+
+def freeze():
+    """
+    Collect garbage and freeze the remaining objects, so they are not written
+    to (and therefore copied) by the garbage collector in child processes.
+
+    """
+    gc.collect()
+    if hasattr(gc, "freeze"):  # Not available on PyPy
+        gc.freeze()
+
+
+def memory_usage():
+    """
+    Return a dictionary of ``rss``, ``shared`` and ``private`` memory of the
+    current process in bytes, or ``None`` if unavailable.  Only supported on
+    Linux.
+
+    """
+    try:
+        with open(SMAPS_ROLLUP) as fh:
+            lines = fh.readlines()
+    except OSError:
+        return None
+    fields = dict()
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "shared": fields.get("Shared_Clean", 0)
+        + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0)
+        + fields.get("Private_Dirty", 0),
+    }
+
+
+def log_memory_usage(when):
+    usage = memory_usage()
+    if usage is None:
+        return
+    logger.info(
+        "Worker process %s %s: rss=%.1fMiB shared=%.1fMiB private=%.1fMiB",
+        os.getpid(),
+        when,
+        usage["rss"] / 2**20,
+        usage["shared"] / 2**20,
+        usage["private"] / 2**20,
+    )
+
+
+def _connect_child_signals():
+    def on_init(**kwargs):
+        log_memory_usage("started")
+
+    def on_shutdown(**kwargs):
+        log_memory_usage("exiting")
+
+    signals.worker_process_init.connect(on_init, weak=False)
+    signals.worker_process_shutdown.connect(on_shutdown, weak=False)
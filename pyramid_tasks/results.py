@@ -0,0 +1,324 @@
+"""
+Helpers for looking up task results.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from celery import states
+from celery.exceptions import TimeoutError
+from kombu.utils.encoding import bytes_to_str
+
+from .debounce import _is_redis
+from .executor import get_executor
+
+TaskState = namedtuple("TaskState", ["state", "result"])
+TaskState.__doc__ = "The state and result of a task."
+
+
+def includeme(config):
+    settings = config.get_settings()
+    max_size = int(settings.get("pyramid_tasks.result_cache.max_size", 0))
+    ttl = float(settings.get("pyramid_tasks.result_cache.ttl", 300))
+    cache = ResultCache(max_size, ttl) if max_size > 0 else None
+    config.registry["pyramid_tasks.result_cache"] = cache
+    config.add_request_method(get_task_result)
+    config.add_request_method(get_task_results)
+    config.add_request_method(iter_task_results)
+
+
+def get_task_result(request, task_id):
+    """
+    Get a result object from celery.
+
+    """
+    registry = request.registry
+    executor = get_executor(registry)
+    if executor is not None:
+        return executor.result(task_id)
+    app = registry["pyramid_tasks.app"]
+    cache = registry["pyramid_tasks.result_cache"]
+    if cache is None:
+        return app.AsyncResult(task_id)
+    result = _get_result_class(registry)(task_id)
+    meta = cache.get(task_id)
+    if meta is not None:
+        result._set_cache(meta)
+    return result
+
+
+def _get_result_class(registry):
+    """
+    Get a subclass of ``AsyncResult`` which adds results to the result cache
+    once ready.  The cache holds the metadata as returned by the backend,
+    before offloaded results are resolved.
+
+    """
+    cls = registry.get("pyramid_tasks.result_class")
+    if cls is not None:
+        return cls
+    cache = registry["pyramid_tasks.result_cache"]
+
+    class CachingAsyncResult(registry["pyramid_tasks.app"].AsyncResult):
+        def _set_cache(self, d):
+            # Only called by Celery once the task is in a ready state.
+            cache.set(self.id, d)
+            # Celery modifies the metadata, so keep the cached copy intact.
+            return super()._set_cache(dict(d))
+
+    registry["pyramid_tasks.result_class"] = CachingAsyncResult
+    return CachingAsyncResult
+
+
+class ResultCache:
+    """
+    A bounded, process-local LRU cache of the metadata of tasks in a ready
+    state (``SUCCESS``, ``FAILURE`` or ``REVOKED``), which never change.
+    Entries expire after ``ttl`` seconds.
+
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, task_id):
+        with self._lock:
+            entry = self._data.get(task_id)
+            if entry is not None:
+                expires, meta = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(task_id)
+                    self.hits += 1
+                    return meta
+                del self._data[task_id]
+            self.misses += 1
+            return None
+
+    def set(self, task_id, meta):
+        if meta.get("status") not in states.READY_STATES:
+            return
+        with self._lock:
+            self._data[task_id] = (time.monotonic() + self.ttl, meta)
+            self._data.move_to_end(task_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_task_results(request, task_ids):
+    """
+    Get the state and result of many tasks at once.  Returns a dictionary
+    mapping each task ID to a :class:`TaskState`.
+
+    If the result backend supports it (e.g. Redis or Memcached), all results
+    are fetched with a single round trip.  Otherwise, each result is fetched
+    individually.
+
+    """
+    registry = request.registry
+    executor = get_executor(registry)
+    if executor is not None:
+        results = [executor.result(task_id) for task_id in task_ids]
+        return {
+            result.id: TaskState(result.state, result.result)
+            for result in results
+        }
+    backend = registry["pyramid_tasks.app"].backend
+    cache = registry["pyramid_tasks.result_cache"]
+    task_ids = list(task_ids)
+    metas = dict()
+    if cache is not None:
+        for task_id in task_ids:
+            meta = cache.get(task_id)
+            if meta is not None:
+                metas[task_id] = meta
+        task_ids = [task_id for task_id in task_ids if task_id not in metas]
+    fetched = _get_many_meta(backend, task_ids) if task_ids else dict()
+    if cache is not None:
+        for task_id, meta in fetched.items():
+            cache.set(task_id, meta)
+    metas.update(fetched)
+    resolve = _get_resolver(registry)
+    return {
+        task_id: TaskState(meta["status"], resolve(meta.get("result")))
+        for task_id, meta in metas.items()
+    }
+
+
+def _get_resolver(registry):
+    claim_check = registry["pyramid_tasks.claim_check"]
+    if claim_check is not None:
+        return claim_check.resolve_result
+    return _identity
+
+
+def _identity(value):
+    return value
+
+
+def iter_task_results(request, results, timeout=None, interval=0.5):
+    """
+    Yield ``(task_id, TaskState)`` for each of ``results``, which may be
+    ``AsyncResult`` objects or task IDs, as each task finishes.  Raises
+    ``celery.exceptions.TimeoutError`` if any are still unfinished
+    ``timeout`` seconds after this is called.
+
+    With the Redis result backend, results are pushed using pub/sub.
+    Otherwise, all unfinished tasks are polled every ``interval`` seconds,
+    using :meth:`get_task_results`.
+
+    """
+    registry = request.registry
+    task_ids = list(dict.fromkeys(getattr(r, "id", r) for r in results))
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    backend = registry["pyramid_tasks.app"].backend
+    if get_executor(registry) is None and _is_redis(backend):
+        return _iter_subscribed(request, task_ids, deadline, interval)
+    return _iter_polled(request, task_ids, deadline, interval)
+
+
+def _get_ready(request, task_ids):
+    """
+    Return a dictionary mapping the IDs of finished tasks to their
+    :class:`TaskState`.
+
+    """
+    return {
+        task_id: task_state
+        for task_id, task_state in get_task_results(request, task_ids).items()
+        if task_state.state in states.READY_STATES
+    }
+
+
+def _get_wait(deadline, interval):
+    """
+    Return how long to wait for, or raise ``TimeoutError`` if the deadline
+    has passed.
+
+    """
+    if deadline is None:
+        return interval
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("The operation timed out.")
+    return min(interval, remaining)
+
+
+def _iter_polled(request, task_ids, deadline, interval):
+    pending = list(task_ids)
+    while pending:
+        ready = _get_ready(request, pending)
+        for task_id in pending:
+            if task_id in ready:
+                yield task_id, ready[task_id]
+        pending = [task_id for task_id in pending if task_id not in ready]
+        if pending:
+            time.sleep(_get_wait(deadline, interval))
+
+
+def _iter_subscribed(request, task_ids, deadline, interval):
+    registry = request.registry
+    backend = registry["pyramid_tasks.app"].backend
+    cache = registry["pyramid_tasks.result_cache"]
+    resolve = _get_resolver(registry)
+    channels = {
+        bytes_to_str(backend.get_key_for_task(task_id)): task_id
+        for task_id in task_ids
+    }
+    pending = set(task_ids)
+    pubsub = backend.client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(*channels)
+        # Fetch results published before subscribing.
+        ready = _get_ready(request, task_ids)
+        for task_id in task_ids:
+            if task_id in ready:
+                pending.discard(task_id)
+                yield task_id, ready[task_id]
+        while pending:
+            message = pubsub.get_message(timeout=_get_wait(deadline, interval))
+            if message is None or message["type"] != "message":
+                continue
+            task_id = channels.get(bytes_to_str(message["channel"]))
+            if task_id not in pending:
+                continue
+            meta = backend.meta_from_decoded(
+                backend.decode_result(message["data"])
+            )
+            if meta["status"] not in states.READY_STATES:
+                continue
+            if cache is not None:
+                cache.set(task_id, meta)
+            pending.discard(task_id)
+            yield (
+                task_id,
+                TaskState(meta["status"], resolve(meta.get("result"))),
+            )
+    finally:
+        pubsub.close()
+
+
+def _get_many_meta(backend, task_ids):
+    """
+    Get the task metadata for each of ``task_ids``, using a single ``mget``
+    where possible.
+
+    """
+    cache = getattr(backend, "_cache", dict())
+    metas = dict()
+    missing = list()
+    for task_id in task_ids:
+        cached = cache.get(task_id)
+        if cached is not None and cached["status"] in states.READY_STATES:
+            metas[task_id] = cached
+        else:
+            missing.append(task_id)
+    if not missing:
+        return metas
+
+    try:
+        values = _mget(backend, missing)
+    except NotImplementedError:
+        for task_id in missing:
+            metas[task_id] = backend.get_task_meta(task_id)
+        return metas
+
+    for task_id, value in zip(missing, values):
+        if value:
+            meta = backend.meta_from_decoded(backend.decode_result(value))
+        else:
+            meta = {"status": states.PENDING, "result": None}
+        if meta["status"] in states.READY_STATES:
+            cache[task_id] = meta
+        metas[task_id] = meta
+    return metas
+
+
+def _mget(backend, task_ids):
+    """
+    Fetch the raw values for ``task_ids`` from a key/value backend, returned
+    in the same order.  Raises ``NotImplementedError`` if unsupported.
+
+    """
+    mget = getattr(backend, "mget", None)
+    if mget is None:
+        raise NotImplementedError()
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = mget(keys)
+    if hasattr(values, "items"):
+        # Some clients return a dictionary rather than a list.
+        return [values.get(key) for key in keys]
+    return values
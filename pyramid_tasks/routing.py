@@ -0,0 +1,373 @@
+"""
+Routing tasks to queues, either from settings or adaptively by run time, so
+slow tasks do not hold up fast ones.
+
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from celery import signals
+from pyramid.path import DottedNameResolver
+from pyramid.util import FIRST
+
+from .debounce import _is_redis
+
+logger = logging.getLogger(__name__)
+
+ROUTES_PREFIX = "pyramid_tasks.routes."
+
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+
+def includeme(config):
+    settings = config.get_settings()
+    overrides = {
+        key[len(ROUTES_PREFIX) :]: value
+        for key, value in settings.items()
+        if key.startswith(ROUTES_PREFIX) and value
+    }
+    slow_queue = settings.get("pyramid_tasks.routing.slow_queue") or None
+    store = None
+    if slow_queue is not None:
+        window = float(settings.get("pyramid_tasks.routing.window", 3600))
+        store = settings.get("pyramid_tasks.routing.store", "backend")
+        if store == "backend":
+            store = BackendRuntimeStore(config.registry, window)
+        elif store == "memory":
+            store = MemoryRuntimeStore(window)
+        else:
+            store = DottedNameResolver().maybe_resolve(store)(config.registry)
+        recorder = RuntimeRecorder(
+            store,
+            report_interval=float(
+                settings.get("pyramid_tasks.routing.report_interval", 10)
+            ),
+        )
+        config.registry["pyramid_tasks.runtime_recorder"] = recorder
+        config.add_task_deriver(runtime_task_deriver, under=FIRST)
+        signals.worker_process_shutdown.connect(
+            lambda **kwargs: recorder.report(), weak=False
+        )
+    router = None
+    if overrides or slow_queue is not None:
+        router = AdaptiveRouter(
+            store,
+            overrides=overrides,
+            slow_queue=slow_queue,
+            threshold=float(
+                settings.get("pyramid_tasks.routing.threshold", 1.0)
+            ),
+            percentile=float(
+                settings.get("pyramid_tasks.routing.percentile", 95)
+            ),
+            min_samples=int(
+                settings.get("pyramid_tasks.routing.min_samples", 20)
+            ),
+            cache_ttl=float(
+                settings.get("pyramid_tasks.routing.cache_ttl", 60)
+            ),
+        )
+        _install_router(config.registry["pyramid_tasks.app"], router)
+    config.registry["pyramid_tasks.router"] = router
+
+
+def _install_router(app, router):
+    """
+    Add ``router`` after any routes already configured with
+    ``celery.task_routes``.
+
+    """
+    routes = app.conf.task_routes
+    if routes is None:
+        routes = ()
+    elif not isinstance(routes, (list, tuple)):
+        routes = (routes,)
+    app.conf.task_routes = (*routes, router)
+
+
+def runtime_task_deriver(task, info):
+    """
+    Record how long the task takes to run, for :class:`AdaptiveRouter`.
+
+    """
+    recorder = info.registry["pyramid_tasks.runtime_recorder"]
+    name = info.name
+
+    if info.is_async:
+
+        async def async_deriver(request, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await task(request, *args, **kwargs)
+            finally:
+                recorder.observe(name, time.perf_counter() - started)
+                recorder.maybe_report()
+
+        return async_deriver
+
+    def deriver(request, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return task(request, *args, **kwargs)
+        finally:
+            recorder.observe(name, time.perf_counter() - started)
+            recorder.maybe_report()
+
+    return deriver
+
+
+def get_percentile(counts, percentile):
+    """
+    Estimate a percentile from histogram ``counts`` over :data:`BUCKETS`,
+    rounding up to the upper bound of the bucket it falls in.  Returns
+    ``None`` if there are no samples.
+
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    target = total * percentile / 100
+    cumulative = 0
+    for i, count in enumerate(counts):
+        cumulative += count
+        if cumulative >= target:
+            break
+    return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+
+
+class AdaptiveRouter:
+    """
+    A Celery router.  Tasks named in ``overrides`` are sent to the given
+    queue.  If ``slow_queue`` is set, tasks whose run time at ``percentile``
+    exceeds ``threshold`` seconds are sent to it, once at least
+    ``min_samples`` runs have been recorded in ``store``.  Other tasks are
+    left to Celery's default routing.
+
+    Decisions are cached for ``cache_ttl`` seconds, so the store is read at
+    most that often per task and process.
+
+    """
+
+    def __init__(
+        self,
+        store,
+        overrides=None,
+        slow_queue=None,
+        threshold=1.0,
+        percentile=95,
+        min_samples=20,
+        cache_ttl=60,
+    ):
+        self.store = store
+        self.overrides = overrides or dict()
+        self.slow_queue = slow_queue
+        self.threshold = threshold
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.cache_ttl = cache_ttl
+        self._cache = dict()
+
+    def __call__(self, name, args, kwargs, options, task=None, **kw):
+        queue = self.overrides.get(name)
+        if queue is None and self.slow_queue is not None:
+            queue = self.get_queue(name)
+        # Celery modifies the route, so a new one is needed each time.
+        return {"queue": queue} if queue is not None else None
+
+    def get_queue(self, name):
+        """
+        Return the slow queue if ``name`` is a slow task, otherwise ``None``.
+
+        """
+        now = time.monotonic()
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        try:
+            queue = self._decide(name)
+        except Exception:
+            logger.exception("Could not get run times for task %s", name)
+            queue = None
+        self._cache[name] = (now + self.cache_ttl, queue)
+        return queue
+
+    def _decide(self, name):
+        counts = self.store.get(name)
+        if not counts or sum(counts) < self.min_samples:
+            return None
+        runtime = get_percentile(counts, self.percentile)
+        return self.slow_queue if runtime > self.threshold else None
+
+
+class RuntimeRecorder:
+    """
+    Collects task run times in the current process and adds them to
+    ``store`` at most every ``report_interval`` seconds.
+
+    """
+
+    def __init__(self, store, report_interval=10.0):
+        self.store = store
+        self.report_interval = report_interval
+        self._counts = dict()
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            counts = self._counts.get(name)
+            if counts is None:
+                counts = self._counts[name] = [0] * (len(BUCKETS) + 1)
+            counts[bisect_left(BUCKETS, seconds)] += 1
+
+    def maybe_report(self):
+        if time.monotonic() - self._last_report >= self.report_interval:
+            self.report()
+
+    def report(self):
+        with self._lock:
+            pending, self._counts = self._counts, dict()
+            self._last_report = time.monotonic()
+        for name, counts in pending.items():
+            try:
+                self.store.add(name, counts)
+            except Exception:
+                logger.exception("Could not report run times for %s", name)
+
+
+def _get_periods(window):
+    """
+    Return the current and previous period numbers for a ``window``.  Run
+    times are stored per period, and the last two are combined, so old run
+    times age out.
+
+    """
+    current = int(time.time() // window)
+    return current, current - 1
+
+
+def _add_counts(total, counts):
+    if total is None:
+        return list(counts)
+    return [a + b for a, b in zip(total, counts)]
+
+
+class MemoryRuntimeStore:
+    """
+    Stores run times in memory.  Only suitable for testing or when tasks are
+    run and deferred by a single process.
+
+    """
+
+    def __init__(self, window=3600):
+        self.window = window
+        self._data = dict()
+        self._lock = threading.Lock()
+
+    def add(self, name, counts):
+        """
+        Add histogram ``counts`` to the run times of the task ``name``.
+
+        """
+        key = (name, _get_periods(self.window)[0])
+        with self._lock:
+            self._data[key] = _add_counts(self._data.get(key), counts)
+
+    def get(self, name):
+        """
+        Return the histogram counts for the task ``name`` over the last one
+        to two windows, or ``None``.
+
+        """
+        total = None
+        with self._lock:
+            for period in _get_periods(self.window):
+                counts = self._data.get((name, period))
+                if counts is not None:
+                    total = _add_counts(total, counts)
+        return total
+
+
+class BackendRuntimeStore:
+    """
+    Stores run times in Celery's result backend, which must be a key/value
+    store such as Redis or Memcached.  With Redis, counts are incremented
+    atomically.  Other backends read and then write, so concurrent reports
+    may occasionally be lost.
+
+    """
+
+    prefix = "pyramid-tasks-runtime-"
+
+    def __init__(self, registry, window=3600):
+        self.registry = registry
+        self.window = window
+
+    @property
+    def backend(self):
+        backend = self.registry["pyramid_tasks.app"].backend
+        if not hasattr(backend, "get_key_for_task"):
+            raise NotImplementedError(
+                "Adaptive routing requires a key/value result backend."
+            )
+        return backend
+
+    def _key(self, backend, name, period):
+        return backend.key_t(f"{self.prefix}{name}:{period}")
+
+    def add(self, name, counts):
+        backend = self.backend
+        key = self._key(backend, name, _get_periods(self.window)[0])
+        if _is_redis(backend):
+            with backend.client.pipeline() as pipe:
+                for i, count in enumerate(counts):
+                    if count:
+                        pipe.hincrby(key, i, count)
+                pipe.expire(key, int(self.window * 2))
+                pipe.execute()
+            return
+        existing = backend.get(key)
+        if existing:
+            counts = _add_counts(json.loads(existing), counts)
+        backend.set(key, json.dumps(counts))
+
+    def get(self, name):
+        backend = self.backend
+        total = None
+        for period in _get_periods(self.window):
+            key = self._key(backend, name, period)
+            if _is_redis(backend):
+                fields = backend.client.hgetall(key)
+                if not fields:
+                    continue
+                counts = [0] * (len(BUCKETS) + 1)
+                for i, count in fields.items():
+                    counts[int(i)] = int(count)
+            else:
+                existing = backend.get(key)
+                if not existing:
+                    continue
+                counts = json.loads(existing)
+            total = _add_counts(total, counts)
+        return total
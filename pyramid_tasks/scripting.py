@@ -0,0 +1,127 @@
+"""
+A leaner equivalent of :func:`pyramid.scripting.prepare` for building the
+request object passed into each task.
+
+"""
+
+import io
+from contextlib import contextmanager
+
+from pyramid.interfaces import (
+    IRequestExtensions,
+    IRequestFactory,
+    IRootFactory,
+)
+from pyramid.request import Request
+from pyramid.threadlocal import manager
+from pyramid.traversal import DefaultRootFactory
+from webob.request import environ_from_url
+
+_marker = object()
+
+
+def includeme(config):
+    config.registry["pyramid_tasks.request_builder"] = RequestBuilder(
+        config.registry
+    )
+
+
+def get_request_builder(registry):
+    return registry["pyramid_tasks.request_builder"]
+
+
+class RequestBuilder:
+    """
+    Creates and prepares task requests.
+
+    :func:`pyramid.scripting.prepare` looks up the request factory, request
+    extensions and root factory on every call, builds a new environ via
+    ``Request.blank`` and creates a new class for every request that has
+    properties added by ``add_request_method``.  This does the same work, but
+    resolves everything once (on first use, so once per worker process) and
+    reuses it for every task thereafter.
+
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._resolved = False
+        self._classes = dict()
+
+    def _resolve(self):
+        registry = self.registry
+        self.request_factory = registry.queryUtility(
+            IRequestFactory, default=Request
+        )
+        self.extensions = registry.queryUtility(IRequestExtensions)
+        self.root_factory = registry.queryUtility(
+            IRootFactory, default=DefaultRootFactory
+        )
+        self.base_environ = environ_from_url("/")
+        self._resolved = True
+
+    def make_request(self, environ=None):
+        """
+        Create a new request, equivalent to
+        ``request_factory.blank("/", environ=environ)``.
+
+        """
+        if not self._resolved:
+            self._resolve()
+        env = self.base_environ.copy()
+        env["wsgi.input"] = io.BytesIO()
+        if environ:
+            env.update(environ)
+        request = self.request_factory(env)
+        request.registry = self.registry
+        self._apply_extensions(request)
+        return request
+
+    def _apply_extensions(self, request):
+        """
+        Apply request extensions.  Rather than creating a new class for each
+        request, as :func:`pyramid.request.apply_request_extensions` does, the
+        extended class is created once and reused.
+
+        """
+        extensions = self.extensions
+        if extensions is None:
+            return
+        parent = request.__class__
+        cls = self._classes.get(parent)
+        if cls is None:
+            cls = self._classes[parent] = self._make_class(parent)
+        request.__class__ = cls
+
+    def _make_class(self, parent):
+        attrs = dict(self.extensions.descriptors)
+        attrs.update(self.extensions.methods)
+        attrs.setdefault("__module__", parent.__module__)
+        cls = type(parent.__name__, (parent, object), attrs)
+        # See InstancePropertyHelper.apply_properties for why these are copied.
+        for name in ("__implemented__", "__provides__"):
+            val = getattr(parent, name, _marker)
+            if val is not _marker:
+                setattr(cls, name, val)
+        return cls
+
+    @contextmanager
+    def prepare(self, request):
+        """
+        Push the request onto the threadlocal stack and set the context, as
+        :func:`pyramid.scripting.prepare` does.
+
+        """
+        if not self._resolved:
+            self._resolve()
+        manager.push({"registry": self.registry, "request": request})
+        try:
+            if getattr(request, "context", None) is None:
+                request.context = self.root_factory(request)
+            yield request
+        finally:
+            try:
+                if request.finished_callbacks:
+                    request._process_finished_callbacks()
+            finally:
+                manager.pop()
@@ -0,0 +1,164 @@
+"""
+Serializers for task arguments and results.
+
+"""
+
+import datetime
+import decimal
+import uuid
+import zlib
+
+from kombu import serialization
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+SERIALIZER_NAME = "pyramid_msgpack"
+CONTENT_TYPE = "application/x-pyramid-msgpack"
+
+# The msgpack extension type used for values with a type adapter.
+EXT_CODE = 1
+
+# Prefixed to compressed payloads.  This byte is never used by msgpack.
+_COMPRESSED = b"\xc1"
+
+
+def includeme(config):
+    settings = config.get_settings()
+    threshold = int(
+        settings.get("pyramid_tasks.serializer.compress_threshold", 0)
+    )
+    serializer = TaskSerializer(threshold)
+    config.registry["pyramid_tasks.serializer"] = serializer
+    config.add_directive("add_task_serializer", add_task_serializer)
+    config.add_directive("add_task_type_adapter", add_task_type_adapter)
+    config.add_task_type_adapter(
+        datetime.datetime,
+        datetime.datetime.isoformat,
+        datetime.datetime.fromisoformat,
+        name="datetime",
+    )
+    config.add_task_type_adapter(
+        datetime.date,
+        datetime.date.isoformat,
+        datetime.date.fromisoformat,
+        name="date",
+    )
+    config.add_task_type_adapter(
+        datetime.time,
+        datetime.time.isoformat,
+        datetime.time.fromisoformat,
+        name="time",
+    )
+    config.add_task_type_adapter(
+        decimal.Decimal, str, decimal.Decimal, name="decimal"
+    )
+    config.add_task_type_adapter(uuid.UUID, str, uuid.UUID, name="uuid")
+    if msgpack is not None:
+        config.add_task_serializer(
+            SERIALIZER_NAME,
+            serializer.dumps,
+            serializer.loads,
+            content_type=CONTENT_TYPE,
+            content_encoding="binary",
+        )
+
+
+def add_task_serializer(
+    config,
+    name,
+    encoder,
+    decoder,
+    content_type,
+    content_encoding="utf-8",
+):
+    """
+    Register a serializer with Kombu, so it can be used by setting
+    ``celery.task_serializer`` and ``celery.result_serializer``.  It must
+    also be added to ``celery.accept_content``.
+
+    """
+
+    def register():
+        serialization.register(
+            name,
+            encoder,
+            decoder,
+            content_type=content_type,
+            content_encoding=content_encoding,
+        )
+
+    config.action(("task serializer", name), register)
+
+
+def add_task_type_adapter(config, type_, encode, decode, name=None):
+    """
+    Add support for ``type_`` to the built-in serializer.  ``encode`` must
+    convert an instance into a value msgpack can serialize and ``decode``
+    must convert it back.  Only instances of exactly ``type_`` are adapted,
+    not subclasses.
+
+    """
+    if name is None:
+        name = f"{type_.__module__}.{type_.__qualname__}"
+    serializer = config.registry["pyramid_tasks.serializer"]
+
+    def register():
+        serializer.add_adapter(type_, name, encode, decode)
+
+    config.action(("task type adapter", name), register)
+
+
+class TaskSerializer:
+    """
+    A msgpack serializer which preserves ``bytes`` and any type with a
+    registered adapter.  Payloads larger than ``compress_threshold`` bytes
+    are compressed with zlib, unless the threshold is zero.
+
+    """
+
+    def __init__(self, compress_threshold=0):
+        self.compress_threshold = compress_threshold
+        self._encoders = dict()
+        self._decoders = dict()
+
+    def add_adapter(self, type_, name, encode, decode):
+        self._encoders[type_] = (name, encode)
+        self._decoders[name] = decode
+
+    def dumps(self, obj):
+        data = msgpack.packb(obj, default=self._default, use_bin_type=True)
+        if self.compress_threshold and len(data) > self.compress_threshold:
+            data = _COMPRESSED + zlib.compress(data)
+        return data
+
+    def loads(self, data):
+        if data[:1] == _COMPRESSED:
+            data = zlib.decompress(data[1:])
+        return msgpack.unpackb(
+            data, ext_hook=self._ext_hook, raw=False, strict_map_key=False
+        )
+
+    def _default(self, obj):
+        try:
+            name, encode = self._encoders[type(obj)]
+        except KeyError:
+            raise TypeError(
+                f"Object of type {type(obj).__name__} is not serializable."
+            ) from None
+        return msgpack.ExtType(
+            EXT_CODE,
+            msgpack.packb(
+                (name, encode(obj)), default=self._default, use_bin_type=True
+            ),
+        )
+
+    def _ext_hook(self, code, data):
+        if code != EXT_CODE:
+            return msgpack.ExtType(code, data)
+        name, value = msgpack.unpackb(
+            data, ext_hook=self._ext_hook, raw=False, strict_map_key=False
+        )
+        return self._decoders[name](value)
@@ -0,0 +1,116 @@
+"""
+Periodic tasks which fan out into many shards on each tick.
+
+"""
+
+import celery
+from pyramid.interfaces import PHASE3_CONFIG
+
+from . import _before_defer, _dispatch, _get_task
+
+FAN_OUT_TASK = "pyramid_tasks.fan_out"
+
+
+def includeme(config):
+    config.registry["pyramid_tasks.sharded_periodic_tasks"] = dict()
+    config.add_directive(
+        "add_sharded_periodic_task",
+        add_sharded_periodic_task,
+        action_wrap=True,
+    )
+
+
+def add_sharded_periodic_task(
+    config,
+    schedule,
+    func_or_name,
+    args=(),
+    kwargs=None,
+    shards=None,
+    partition=None,
+    callback=None,
+    name=None,
+    **opts,
+):
+    """
+    Add a periodic task which is deferred ``shards`` times on each tick.
+
+    Each shard is called with the ``shard`` and ``shards`` keyword arguments,
+    the index of the shard and the number of shards.  If ``partition`` is
+    given, it is called on each tick as ``partition(request, shards)`` and
+    must return a list of serializable values, such as key ranges.  The task
+    is deferred once for each value, which is passed as ``shard``, and
+    ``shards`` is the number of values.
+
+    If ``callback`` is given, it is deferred with a list of the results of
+    every shard once they have all finished, using a Celery chord.
+
+    """
+    if shards is None and partition is None:
+        raise ValueError("Either shards or partition must be given.")
+    registry = config.registry
+    if not registry.get("pyramid_tasks.fan_out_registered"):
+        config.register_task(fan_out_task, name=FAN_OUT_TASK)
+        registry["pyramid_tasks.fan_out_registered"] = True
+    if name is not None:
+        key = name
+    elif isinstance(func_or_name, str):
+        key = func_or_name
+    else:
+        key = f"{func_or_name.__module__}.{func_or_name.__qualname__}"
+    entries = registry["pyramid_tasks.sharded_periodic_tasks"]
+
+    def add():
+        entries[key] = {
+            "task": _get_task(registry, func_or_name),
+            "args": tuple(args),
+            "kwargs": dict(kwargs or ()),
+            "shards": shards,
+            "partition": partition,
+            "callback": (
+                _get_task(registry, callback) if callback is not None else None
+            ),
+            "options": opts,
+        }
+        registry["pyramid_tasks.app"].add_periodic_task(
+            schedule,
+            _get_task(registry, FAN_OUT_TASK),
+            (key,),
+            {},
+            name=name,
+            **opts,
+        )
+
+    config.action(("sharded periodic task", key), add, order=PHASE3_CONFIG)
+
+
+def fan_out_task(request, key):
+    """
+    Defer each shard of a sharded periodic task.  Returns the IDs of the
+    shards, or the ID of the callback if there is one.
+
+    """
+    entry = request.registry["pyramid_tasks.sharded_periodic_tasks"][key]
+    partition = entry["partition"]
+    if partition is None:
+        values = list(range(entry["shards"]))
+    else:
+        values = list(partition(request, entry["shards"]))
+    deferrals = [
+        _before_defer(
+            request,
+            entry["task"].name,
+            entry["args"],
+            dict(entry["kwargs"], shard=value, shards=len(values)),
+            dict(entry["options"]),
+        )
+        for value in values
+    ]
+    callback = entry["callback"]
+    if callback is None:
+        return [result.id for result in _dispatch(request, deferrals)]
+    header = [
+        task.signature(args, kwargs, **options)
+        for task, args, kwargs, options in deferrals
+    ]
+    return celery.chord(header)(callback.signature()).id
@@ -3,14 +3,23 @@ Task derivers are the task analog of Pyramid's view derivers.
 
 """
 
+import inspect
+import threading
+
 from pyramid.interfaces import PHASE0_CONFIG
+from pyramid.settings import asbool
 from pyramid.util import TopologicalSorter
+from zope.interface import implementer
 
 from .interfaces import ITaskDerivers
 
 
 def includeme(config):
-    config.registry.registerUtility(TopologicalSorter(), ITaskDerivers)
+    settings = config.get_settings()
+    config.registry["pyramid_tasks.lazy_derivation"] = asbool(
+        settings.get("pyramid_tasks.lazy_derivation", False)
+    )
+    config.registry.registerUtility(TaskDerivers(), ITaskDerivers)
     config.add_directive(
         "add_task_deriver", add_task_deriver, action_wrap=True
     )
@@ -59,6 +68,51 @@ def apply_task_derivers(config, task, name, options):
     return task
 
 
+def apply_task_derivers_lazily(config, task, name, options):
+    """
+    Return a task that will apply the task derivers upon first invocation.
+
+    """
+    lock = threading.Lock()
+    derived = None
+
+    def wrapper(request, *args, **kwargs):
+        nonlocal derived
+        if derived is None:
+            with lock:
+                if derived is None:
+                    derived = apply_task_derivers(config, task, name, options)
+        return derived(request, *args, **kwargs)
+
+    return wrapper
+
+
+@implementer(ITaskDerivers)
+class TaskDerivers(TopologicalSorter):
+    """
+    A topological sorter that caches the sorted list of task derivers until
+    it's modified, rather than re-sorting for every task registered.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._sorted = None
+
+    def add(self, name, val, after=None, before=None):
+        self._sorted = None
+        return super().add(name, val, after=after, before=before)
+
+    def remove(self, name):
+        self._sorted = None
+        return super().remove(name)
+
+    def sorted(self):
+        if self._sorted is None:
+            self._sorted = super().sorted()
+        return self._sorted
+
+
 class TaskDeriverInfo:
     def __init__(self, registry, package, name, options, original_func):
         self.registry = registry
@@ -66,3 +120,4 @@ class TaskDeriverInfo:
         self.name = name
         self.options = options
         self.original_func = original_func
+        self.is_async = inspect.iscoroutinefunction(original_func)
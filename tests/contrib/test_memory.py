@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import tracemalloc
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks.contrib.memory import (
+    TaskMemory,
+    get_max_rss,
+    memory_task_deriver,
+)
+from pyramid_tasks.contrib.metrics import TaskMetrics
+
+
+def make_info(memory, metrics=None, is_async=False):
+    registry = {"pyramid_tasks.memory": memory}
+    if metrics is not None:
+        registry["pyramid_tasks.metrics"] = metrics
+    return SimpleNamespace(registry=registry, name="mytask", is_async=is_async)
+
+
+def call_wrapped(info, task, rss):
+    wrapped = memory_task_deriver(task, info)
+    with patch("pyramid_tasks.contrib.memory.get_max_rss", side_effect=rss):
+        return wrapped(None, 1)
+
+
+def test_deriver():
+    memory = TaskMemory()
+    task = MagicMock(return_value="result")
+    info = make_info(memory)
+    assert call_wrapped(info, task, [100, 300]) == "result"
+    task.assert_called_once_with(None, 1)
+    call_wrapped(info, task, [300, 200])
+    assert memory.snapshot() == {
+        "mytask": {
+            "count": 2,
+            "growth": 200,
+            "max_growth": 200,
+            "allocations": None,
+        }
+    }
+
+
+def test_deriver_failure():
+    memory = TaskMemory()
+    task = MagicMock(side_effect=ValueError)
+    with pytest.raises(ValueError):
+        call_wrapped(make_info(memory), task, [100, 300])
+    assert memory.snapshot()["mytask"]["growth"] == 200
+
+
+def test_deriver_async():
+    memory = TaskMemory()
+
+    async def task(request, value):
+        return value
+
+    wrapped = memory_task_deriver(task, make_info(memory, is_async=True))
+    with patch("pyramid_tasks.contrib.memory.get_max_rss", side_effect=[1, 2]):
+        assert asyncio.run(wrapped(None, "result")) == "result"
+    assert memory.snapshot()["mytask"]["count"] == 1
+
+
+def test_deriver_unavailable():
+    memory = TaskMemory()
+    call_wrapped(make_info(memory), MagicMock(), [None, None])
+    assert memory.snapshot() == {}
+
+
+def test_tracemalloc():
+    memory = TaskMemory(top_allocations=3)
+    leaked = list()
+
+    def task(request, value):
+        leaked.append(bytearray(2**20))
+
+    try:
+        call_wrapped(make_info(memory), task, [0, 2**20])
+    finally:
+        tracemalloc.stop()
+    allocations = memory.snapshot()["mytask"]["allocations"]
+    location, size = allocations[0]
+    assert "test_memory.py" in location
+    assert size >= 2**20
+
+
+def test_get_max_rss():
+    peak = get_max_rss()
+    assert peak > 0
+    ballast = b"x" * 2**24
+    assert get_max_rss() >= peak
+    del ballast
+
+
+def test_over_budget(caplog):
+    conf = SimpleNamespace(worker_max_memory_per_child=1024)
+    memory = TaskMemory(conf=conf)
+    metrics = TaskMetrics()
+    info = make_info(memory, metrics)
+    with caplog.at_level(logging.WARNING):
+        call_wrapped(info, MagicMock(), [0, 2**19])
+        assert not caplog.records
+        call_wrapped(info, MagicMock(), [2**19, 2**21])
+    assert "after task mytask" in caplog.records[0].getMessage()
+    totals = metrics.snapshot()["totals"]
+    assert ["memory_growth_bytes", "mytask", 2**19 + 3 * 2**19] in totals
+    assert ["memory_recycles", "mytask", 1] in totals
+
+
+def test_budget_from_celery():
+    conf = SimpleNamespace(worker_max_memory_per_child=None)
+    memory = TaskMemory(conf=conf)
+    assert memory.max_rss is None
+    conf.worker_max_memory_per_child = 2048
+    assert memory.max_rss == 2**21
+
+
+def test_snapshot_order():
+    memory = TaskMemory()
+    memory.observe({}, "a", 1, 0)
+    memory.observe({}, "b", 5, 0)
+    assert list(memory.snapshot()) == ["b", "a"]
+
+
+def test_includeme():
+    settings = {"pyramid_tasks.memory.max_rss": "1024"}
+    with _testConfig(settings=settings) as config:
+        config.include("pyramid_tasks")
+        config.include("pyramid_tasks.contrib.memory")
+        memory = config.registry["pyramid_tasks.memory"]
+        assert memory.max_rss == 2**20
+        app = config.registry["pyramid_tasks.app"]
+        assert app.conf.worker_max_memory_per_child == 1024
+
+
+def test_includeme_celery_setting():
+    settings = {
+        "pyramid_tasks.memory.max_rss": "1024",
+        "celery.worker_max_memory_per_child": "4096",
+    }
+    with _testConfig(settings=settings) as config:
+        config.include("pyramid_tasks")
+        config.include("pyramid_tasks.contrib.memory")
+        memory = config.registry["pyramid_tasks.memory"]
+        assert memory.max_rss == 4096 * 1024
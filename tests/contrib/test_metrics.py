@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from celery.exceptions import Retry
+from pyramid.testing import DummyRequest
+
+from pyramid_tasks.contrib.metrics import (
+    PUBLISHED_HEADER,
+    TaskMetrics,
+    metrics_task_deriver,
+    stamp_published,
+)
+
+
+class DummyInfo:
+    def __init__(self, registry, name, is_async=False):
+        self.registry = registry
+        self.name = name
+        self.is_async = is_async
+
+
+class TestMetricsTaskDeriver:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.request = DummyRequest()
+        self.metrics = TaskMetrics(buckets=[0.1, 1.0])
+        self.request.registry["pyramid_tasks.metrics"] = self.metrics
+        started = time.time()
+        self.request.environ["pyramid_tasks.started"] = started
+        self.request.current_task = MagicMock()
+        setattr(
+            self.request.current_task.request, PUBLISHED_HEADER, started - 0.5
+        )
+        self.task = MagicMock(return_value="result")
+
+    def call_wrapped(self, *args, **kwargs):
+        info = DummyInfo(self.request.registry, "mytask")
+        wrapped = metrics_task_deriver(self.task, info)
+        return wrapped(self.request, *args, **kwargs)
+
+    def test_success(self):
+        assert self.call_wrapped(1, foo="bar") == "result"
+        self.task.assert_called_once_with(self.request, 1, foo="bar")
+        snapshot = self.metrics.snapshot()
+        assert snapshot["counters"] == [["mytask", "success", 1]]
+        assert snapshot["histograms"]["run"]["mytask"]["counts"] == [1, 0, 0]
+        wait = snapshot["histograms"]["queue_wait"]["mytask"]
+        assert wait["counts"] == [0, 1, 0]
+        assert wait["sum"] >= 0.5
+
+    def test_async(self):
+        async def task(request, value):
+            return value
+
+        info = DummyInfo(self.request.registry, "mytask", is_async=True)
+        wrapped = metrics_task_deriver(task, info)
+        assert asyncio.run(wrapped(self.request, "result")) == "result"
+        snapshot = self.metrics.snapshot()
+        assert snapshot["counters"] == [["mytask", "success", 1]]
+
+    def test_failure(self):
+        self.task.side_effect = ValueError()
+        with pytest.raises(ValueError):
+            self.call_wrapped()
+        self.task.side_effect = Retry()
+        with pytest.raises(Retry):
+            self.call_wrapped()
+        assert sorted(self.metrics.snapshot()["counters"]) == [
+            ["mytask", "failure", 1],
+            ["mytask", "retry", 1],
+        ]
+
+    def test_no_published_header(self):
+        self.request.current_task = None
+        self.call_wrapped()
+        assert self.metrics.snapshot()["histograms"]["queue_wait"] == {}
+
+
+def test_stamp_published():
+    event = MagicMock(options={})
+    stamp_published(event)
+    assert event.options["headers"][PUBLISHED_HEADER] <= time.time()
+    headers = {"foo": "bar"}
+    event = MagicMock(options={"headers": headers})
+    stamp_published(event)
+    assert PUBLISHED_HEADER in event.options["headers"]
+    assert headers == {"foo": "bar"}
+
+
+def test_render():
+    metrics = TaskMetrics(buckets=[0.1, 1.0])
+    metrics.observe("run", "mytask", 0.05)
+    metrics.observe("run", "mytask", 0.5)
+    metrics.increment("mytask", "success")
+    text = metrics.render()
+    assert "# TYPE pyramid_tasks_run_seconds histogram" in text
+    assert 'pyramid_tasks_run_seconds_bucket{task="mytask",le="0.1"} 1' in text
+    assert 'pyramid_tasks_run_seconds_bucket{task="mytask",le="1.0"} 2' in text
+    assert (
+        'pyramid_tasks_run_seconds_bucket{task="mytask",le="+Inf"} 2' in text
+    )
+    assert 'pyramid_tasks_run_seconds_count{task="mytask"} 2' in text
+    assert (
+        'pyramid_tasks_completed_total{task="mytask",outcome="success"} 1'
+        in text
+    )
+
+
+def test_render_totals():
+    metrics = TaskMetrics()
+    metrics.add("memory_growth_bytes", "mytask", 1024)
+    metrics.add("memory_growth_bytes", "mytask", 512)
+    text = metrics.render()
+    assert "# TYPE pyramid_tasks_memory_growth_bytes_total counter" in text
+    assert (
+        'pyramid_tasks_memory_growth_bytes_total{task="mytask"} 1536' in text
+    )
+
+
+def test_collect_directory(tmp_path):
+    child = TaskMetrics(buckets=[1.0], directory=str(tmp_path))
+    child.observe("run", "mytask", 0.5)
+    child.increment("mytask", "success")
+    child.add("memory_recycles", "mytask", 1)
+    # Emulate two worker processes sharing the directory.
+    (tmp_path / "1.json").write_text(json.dumps(child.snapshot()))
+    (tmp_path / "2.json").write_text(json.dumps(child.snapshot()))
+
+    parent = TaskMetrics(buckets=[1.0], directory=str(tmp_path))
+    snapshot = parent.collect()
+    assert snapshot["histograms"]["run"]["mytask"]["counts"] == [2, 0]
+    assert snapshot["counters"] == [["mytask", "success", 2]]
+    assert snapshot["totals"] == [["memory_recycles", "mytask", 2]]
+
+    parent.clear_directory()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_timer(tmp_path):
+    metrics = TaskMetrics(directory=str(tmp_path), flush_interval=0.01)
+    metrics.increment("mytask", "success")
+    metrics.start_timer()
+    metrics.start_timer()
+    path = tmp_path / f"{os.getpid()}.json"
+    deadline = time.monotonic() + 5
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert json.loads(path.read_text())["counters"] == [
+        ["mytask", "success", 1]
+    ]
+
+
+def test_concurrent_flush(tmp_path):
+    metrics = TaskMetrics(directory=str(tmp_path))
+    metrics.increment("mytask", "success")
+    errors = list()
+
+    def run():
+        try:
+            for _ in range(50):
+                metrics.flush()
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [path.name for path in tmp_path.iterdir()] == [
+        f"{os.getpid()}.json"
+    ]
+
+
+def test_maybe_flush_error(tmp_path, caplog):
+    metrics = TaskMetrics(
+        directory=str(tmp_path / "missing"), flush_interval=0
+    )
+    metrics.maybe_flush()
+    assert "Error flushing task metrics." in caplog.text
@@ -1,7 +1,11 @@
+import asyncio
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 
 import pytest
+import transaction
 from pyramid.testing import DummyRequest
+from transaction.interfaces import TransientError
 
 from pyramid_tasks.contrib.pyramid_tm import transaction_task_deriver
 
@@ -14,7 +18,12 @@ class TestTransactionTastDeriver:
         self.request.tm = self.tm
         self.task = MagicMock()
 
-    def call(self, task, info=None):
+    def call(self, task, options=None, settings=None, is_async=False):
+        info = SimpleNamespace(
+            registry=SimpleNamespace(settings=settings or dict()),
+            options=options or dict(),
+            is_async=is_async,
+        )
         return transaction_task_deriver(task, info)
 
     def call_wrapped(self, *args, **kwargs):
@@ -36,3 +45,61 @@ class TestTransactionTastDeriver:
         self.task.assert_called_once_with(self.request, 1, 2, foo="bar")
 
         self.tm.__enter__.assert_not_called()
+
+    def test_retries_retryable_errors(self):
+        self.request.tm = transaction.TransactionManager(explicit=True)
+        self.task.side_effect = [TransientError(), TransientError(), "done"]
+        wrapped = self.call(self.task, {"tm_attempts": 3})
+        assert wrapped(self.request) == "done"
+        assert self.task.call_count == 3
+
+    def test_retries_exhausted(self):
+        self.request.tm = transaction.TransactionManager(explicit=True)
+        self.task.side_effect = TransientError()
+        wrapped = self.call(
+            self.task, settings={"pyramid_tasks.tm.attempts": "2"}
+        )
+        with pytest.raises(TransientError):
+            wrapped(self.request)
+        assert self.task.call_count == 2
+
+    def test_ignores_pyramid_tm_attempts(self):
+        self.request.tm = transaction.TransactionManager(explicit=True)
+        self.task.side_effect = TransientError()
+        wrapped = self.call(self.task, settings={"tm.attempts": "3"})
+        with pytest.raises(TransientError):
+            wrapped(self.request)
+        assert self.task.call_count == 1
+
+    def test_does_not_retry_other_errors(self):
+        self.request.tm = transaction.TransactionManager(explicit=True)
+        self.task.side_effect = ValueError()
+        wrapped = self.call(
+            self.task, settings={"pyramid_tasks.tm.attempts": "3"}
+        )
+        with pytest.raises(ValueError):
+            wrapped(self.request)
+        assert self.task.call_count == 1
+
+    def test_readonly(self):
+        wrapped = self.call(self.task, {"readonly": True})
+        wrapped(self.request)
+        self.tm.begin.assert_called_once_with()
+        self.tm.abort.assert_called_once_with()
+        self.tm.commit.assert_not_called()
+        self.tm.__enter__.assert_not_called()
+
+    def test_async(self):
+        self.request.tm = transaction.TransactionManager(explicit=True)
+        calls = list()
+
+        async def task(request, value):
+            calls.append(value)
+            assert request.tm.get() is not None
+            if len(calls) == 1:
+                raise TransientError()
+            return value
+
+        wrapped = self.call(task, {"tm_attempts": 2}, is_async=True)
+        assert asyncio.run(wrapped(self.request, "done")) == "done"
+        assert calls == ["done", "done"]
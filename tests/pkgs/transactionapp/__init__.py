@@ -12,7 +12,6 @@ def includeme(config):
     config.include("pyramid_tm")
     config.include("pyramid_tasks.contrib.pyramid_tm")
 
-    config.add_settings({"sqlalchemy.url": "sqlite:///db.sqlite3"})
     dbengine = get_engine(config.get_settings())
     Base.metadata.drop_all(bind=dbengine)
     Base.metadata.create_all(bind=dbengine)
@@ -28,6 +27,12 @@ def includeme(config):
 
     config.register_task(increment_task, name="increment")
     config.register_task(total_task, name="total")
+    config.register_task(
+        readonly_total_task, name="readonly_total", readonly=True
+    )
+    config.register_task(
+        readonly_debounce_task, name="readonly_debounce", readonly=True
+    )
 
 
 def get_engine(settings, prefix="sqlalchemy."):
@@ -63,3 +68,18 @@ def increment_task(request, value=1):
 
 def total_task(request):
     return request.db.query(func.sum(Ledger.amount)).scalar() or 0
+
+
+def readonly_total_task(request, value):
+    result = request.defer_task_with_options(
+        "increment", args=(value,), after_commit=True
+    )
+    request.db.add(Ledger(amount=value))
+    return [total_task(request), result.id]
+
+
+def readonly_debounce_task(request, value):
+    result = request.defer_task_with_options(
+        "increment", args=(value,), after_commit=True, debounce=60
+    )
+    return result.id
@@ -0,0 +1,35 @@
+"""
+An application with a separate factory for the worker.
+
+"""
+
+from pyramid.config import Configurator
+
+from pyramid_tasks import is_worker
+
+loaded = []
+
+
+def main(global_config, **settings):
+    loaded.append("wsgi")
+    config = make_config(global_config, **settings)
+    return config.make_wsgi_app()
+
+
+def make_config(global_config, **settings):
+    loaded.append("config")
+    config = Configurator(settings=settings)
+    config.include("pyramid_tasks")
+    config.register_task(add_task, name="workerapp_add")
+    if not is_worker():
+        config.add_route("home", "/")
+    return config
+
+
+def includeme(config):
+    loaded.append("includeme")
+    config.register_task(add_task, name="workerapp_add")
+
+
+def add_task(request, x, y):
+    return x + y
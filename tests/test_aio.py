@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+from pyramid_tasks.aio import close_event_loop, get_event_loop, maybe_await
+
+
+def test_get_event_loop():
+    loop = get_event_loop()
+    try:
+        assert get_event_loop() is loop
+        loops = list()
+        thread = threading.Thread(
+            target=lambda: loops.append(get_event_loop())
+        )
+        thread.start()
+        thread.join()
+        assert loops[0] is not loop
+        loops[0].close()
+    finally:
+        close_event_loop()
+    assert loop.is_closed()
+    assert get_event_loop() is not loop
+    close_event_loop()
+
+
+def test_maybe_await():
+    async def coro():
+        return 1
+
+    assert asyncio.run(maybe_await(coro())) == 1
+    assert asyncio.run(maybe_await(2)) == 2
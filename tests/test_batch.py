@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import pytest
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks.batch import TaskBatcher
+
+
+@pytest.fixture
+def registry():
+    with _testConfig() as config:
+        config.include("pyramid_tasks")
+        yield config.registry
+
+
+def test_flush_every(registry):
+    batches = list()
+
+    def func(request, items):
+        assert request.registry is registry
+        batches.append(items)
+
+    batcher = TaskBatcher(registry, func, 2, None)
+    batcher.add(1)
+    assert batches == []
+    batcher.add(2)
+    batcher.add(3)
+    assert batches == [[1, 2]]
+    assert len(batcher) == 1
+    batcher.flush()
+    assert batches == [[1, 2], [3]]
+    assert batcher.flush() is None
+
+
+def test_flush_failure(registry):
+    batches = list()
+
+    def func(request, items):
+        batches.append(items)
+        if len(batches) == 1:
+            raise ValueError("oops")
+
+    batcher = TaskBatcher(registry, func, 2, None)
+    batcher.add(1)
+    with pytest.raises(ValueError):
+        batcher.add(2)
+    assert len(batcher) == 2
+    batcher.add(3)
+    assert batches == [[1, 2], [1, 2, 3]]
+    assert len(batcher) == 0
+
+
+def test_flush_max_attempts(registry, caplog):
+    batches = list()
+
+    def func(request, items):
+        batches.append(items)
+        if "bad" in items:
+            raise ValueError("oops")
+
+    batcher = TaskBatcher(registry, func, None, None, max_attempts=2)
+    batcher.add("bad")
+    with pytest.raises(ValueError):
+        batcher.flush()
+    batcher.add("good")
+    with pytest.raises(ValueError):
+        batcher.flush()
+    assert "Dropping 1 items" in caplog.text
+    batcher.flush()
+    assert batches == [["bad"], ["bad", "good"], ["good"]]
+    assert len(batcher) == 0
+
+
+def test_max_buffered(registry, caplog):
+    batches = list()
+    batcher = TaskBatcher(
+        registry,
+        lambda request, items: batches.append(items),
+        None,
+        None,
+        max_buffered=2,
+    )
+    for item in range(3):
+        batcher.add(item)
+    assert "Dropping 1 items" in caplog.text
+    batcher.flush()
+    assert batches == [[1, 2]]
+
+
+def test_flush_async(registry):
+    batches = list()
+
+    async def func(request, items):
+        await asyncio.sleep(0)
+        batches.append(items)
+        return len(items)
+
+    batcher = TaskBatcher(registry, func, None, 60)
+    batcher.add(1)
+    batcher.add(2)
+    assert batcher.flush() == 2
+    assert batches == [[1, 2]]
+
+
+def test_flush_interval(registry):
+    batches = list()
+    batcher = TaskBatcher(
+        registry, lambda request, items: batches.append(items), None, 0.05
+    )
+    batcher.add(1)
+    batcher.add(2)
+    deadline = time.monotonic() + 5
+    while not batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert batches == [[1, 2]]
+
+
+def test_register_async_batch_task():
+    async def func(request, items):
+        pass
+
+    with _testConfig() as config:
+        config.include("pyramid_tasks")
+        config.register_batch_task(func, name="func")
+        config.commit()
+        assert config.registry["pyramid_tasks.async_tasks"]
+
+
+def test_register_batch_task_requires_limit():
+    with _testConfig() as config:
+        config.include("pyramid_tasks")
+        with pytest.raises(ValueError):
+            config.register_batch_task(
+                lambda request, items: None,
+                flush_every=None,
+                flush_interval=None,
+            )
@@ -0,0 +1,63 @@
+import pytest
+from pyramid.interfaces import IRoutesMapper
+
+import pyramid_tasks
+from pyramid_tasks.celery import celery, on_preload_parsed
+from tests.pkgs import workerapp
+
+INI = """
+[app:main]
+use = call:tests.pkgs.workerapp:main
+celery.broker_url = memory://
+{extra}
+"""
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    yield
+    pyramid_tasks.set_global_app(None)
+    workerapp.loaded.clear()
+    celery.tasks.pop("workerapp_add", None)
+
+
+def load(tmp_path, extra=""):
+    path = tmp_path / "config.ini"
+    path.write_text(INI.format(extra=extra))
+    on_preload_parsed({"ini": str(path), "ini_var": None})
+    return celery.pyramid_config.registry
+
+
+def test_get_app(tmp_path):
+    registry = load(tmp_path)
+    assert workerapp.loaded == ["wsgi", "config"]
+    assert "workerapp_add" in celery.tasks
+    assert registry.queryUtility(IRoutesMapper) is None
+
+
+def test_worker_factory(tmp_path):
+    load(
+        tmp_path,
+        "pyramid_tasks.worker_factory = tests.pkgs.workerapp:make_config",
+    )
+    assert workerapp.loaded == ["config"]
+    assert "workerapp_add" in celery.tasks
+
+
+def test_configurator_from_settings(tmp_path):
+    extra = "\n".join(
+        [
+            "pyramid_tasks.worker_factory = "
+            "pyramid_tasks.celery:configurator_from_settings",
+            "pyramid.includes = pyramid_tasks tests.pkgs.workerapp",
+        ]
+    )
+    load(tmp_path, extra)
+    assert workerapp.loaded == ["includeme"]
+    assert "workerapp_add" in celery.tasks
+
+
+def test_is_worker():
+    assert not pyramid_tasks.is_worker()
+    pyramid_tasks.set_global_app(celery)
+    assert pyramid_tasks.is_worker()
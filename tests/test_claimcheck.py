@@ -0,0 +1,114 @@
+import os
+
+import pytest
+from pyramid.exceptions import ConfigurationError
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks.claimcheck import (
+    ESCAPE,
+    REFERENCE,
+    ClaimCheck,
+    FilesystemBlobStore,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FilesystemBlobStore(str(tmp_path))
+
+
+def test_store_round_trip(store):
+    key = store.put(b"hello")
+    assert store.put(b"hello") == key
+    view = store.open(key)
+    assert isinstance(view, memoryview)
+    assert view.readonly
+    assert bytes(view) == b"hello"
+
+
+def test_store_purge(store):
+    old = store.put(b"old")
+    new = store.put(b"new")
+    os.utime(store._path(old), (0, 0))
+    store.purge(60)
+    assert not os.path.exists(store._path(old))
+    assert bytes(store.open(new)) == b"new"
+
+
+def test_offload(store):
+    claim_check = ClaimCheck(store, 5)
+    args, kwargs, offloaded = claim_check.offload(
+        (b"small", b"big" * 2, "x" * 10, 12345678),
+        {"a": "abcde", "b": bytearray(b"123456")},
+    )
+    assert offloaded == {"args": [1, 2], "kwargs": ["b"]}
+    assert args[0] == b"small"
+    assert args[1][REFERENCE][0] == "bytes"
+    assert args[2][REFERENCE][0] == "str"
+    assert args[3] == 12345678
+    assert kwargs["a"] == "abcde"
+    assert REFERENCE in kwargs["b"]
+
+    args, kwargs = claim_check.resolve(args, kwargs, offloaded)
+    assert args[0] == b"small"
+    assert isinstance(args[1], memoryview)
+    assert bytes(args[1]) == b"bigbig"
+    assert args[2] == "x" * 10
+    assert kwargs == {"a": "abcde", "b": b"123456"}
+
+
+def test_offload_nothing(store):
+    claim_check = ClaimCheck(store, 5)
+    assert claim_check.offload((1,), {"a": "b"}) == ((1,), {"a": "b"}, None)
+
+
+def test_resolve_only_offloaded(store):
+    claim_check = ClaimCheck(store, 5)
+    key = store.put(b"secret")
+    forged = {REFERENCE: ["bytes", key]}
+    args, kwargs, offloaded = claim_check.offload(
+        (forged, b"123456"), {"a": forged}
+    )
+    assert offloaded == {"args": [1], "kwargs": []}
+    args, kwargs = claim_check.resolve(args, kwargs, offloaded)
+    assert args[0] is forged
+    assert kwargs["a"] is forged
+    assert claim_check.resolve((forged,), {}, None) == ((forged,), {})
+
+
+def test_resolve_ignores_other_dicts(store):
+    claim_check = ClaimCheck(store, 4)
+    value = {REFERENCE: "x", "other": 1}
+    assert claim_check.resolve_value(value) is value
+    assert claim_check.resolve_result(value) is value
+
+
+def test_result_escaping(store):
+    claim_check = ClaimCheck(store, 5)
+    key = store.put(b"secret")
+    for value in ({REFERENCE: ["bytes", key]}, {ESCAPE: 1}):
+        offloaded = claim_check.offload_result(value)
+        assert offloaded == {ESCAPE: value}
+        assert claim_check.resolve_result(offloaded) == value
+    offloaded = claim_check.offload_result("abcdef")
+    assert REFERENCE in offloaded
+    assert claim_check.resolve_result(offloaded) == "abcdef"
+    assert claim_check.resolve_result("abc") == "abc"
+
+
+def test_invalid_reference(store, tmp_path):
+    claim_check = ClaimCheck(store, 5)
+    (tmp_path / "secret").write_text("secret")
+    for key in (str(tmp_path / "secret"), "../secret", "ab" * 31 + "zz"):
+        with pytest.raises(ValueError):
+            claim_check.resolve_value({REFERENCE: ["str", key]})
+    key = store.put(b"secret")
+    with pytest.raises(ValueError):
+        claim_check.resolve_value({REFERENCE: ["pickle", key]})
+
+
+def test_requires_directory():
+    settings = {"pyramid_tasks.claim_check.threshold": "10"}
+    with _testConfig(settings=settings) as config:
+        with pytest.raises(ConfigurationError):
+            config.include("pyramid_tasks")
@@ -0,0 +1,73 @@
+from unittest.mock import Mock
+
+import pytest
+from pyramid.testing import DummyRequest
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks.context import (
+    ENVIRON_KEY,
+    HEADER,
+    TaskContext,
+    add_context_header,
+)
+
+
+@pytest.fixture
+def config():
+    settings = {"pyramid_tasks.context": "host_url\ntraceparent"}
+    with _testConfig(settings=settings) as config:
+        config.include("pyramid_tasks")
+        yield config
+
+
+def test_add_context_header(config):
+    capture = Mock(return_value="acme")
+    config.add_task_context_propagator("tenant", capture)
+    config.add_task_context_propagator("nothing", lambda request: None)
+    request = DummyRequest(registry=config.registry)
+    options = {"headers": {"foo": "bar"}}
+    add_context_header(request, options)
+    add_context_header(request, options)
+    assert options["headers"] == {
+        "foo": "bar",
+        HEADER: {"host_url": "http://example.com", "tenant": "acme"},
+    }
+    capture.assert_called_once_with(request)
+
+
+def test_add_context_header_from_task(config):
+    request = DummyRequest(registry=config.registry)
+    request.environ[ENVIRON_KEY] = {"tenant": "acme"}
+    options = dict()
+    add_context_header(request, options)
+    assert options == {"headers": {HEADER: {"tenant": "acme"}}}
+
+
+def test_add_context_header_disabled():
+    with _testConfig() as config:
+        config.include("pyramid_tasks")
+        request = DummyRequest(registry=config.registry)
+        options = dict()
+        add_context_header(request, options)
+        assert options == dict()
+
+
+def test_unknown_propagator():
+    settings = {"pyramid_tasks.context": "foo"}
+    with _testConfig(settings=settings) as config:
+        with pytest.raises(ValueError):
+            config.include("pyramid_tasks")
+
+
+def test_task_context_restores_lazily(config):
+    restore = Mock(side_effect=lambda request, value: value.upper())
+    config.add_task_context_propagator("tenant", None, restore)
+    request = DummyRequest(registry=config.registry)
+    context = TaskContext(request, {"tenant": "acme", "host_url": "x"})
+    restore.assert_not_called()
+    assert context["tenant"] == "ACME"
+    assert context["tenant"] == "ACME"
+    restore.assert_called_once_with(request, "acme")
+    assert dict(context) == {"tenant": "ACME", "host_url": "x"}
+    with pytest.raises(KeyError):
+        context["other"]
@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import threading
+from types import SimpleNamespace
+
+import pytest
+from pyramid import threadlocal
+from pyramid.testing import testConfig as _testConfig
+from pyramid.threadlocal import get_current_request
+
+from pyramid_tasks.contextlocals import (
+    _on_worker_init,
+    is_patched,
+    patch_threadlocal_manager,
+    unpatch_threadlocal_manager,
+)
+from pyramid_tasks.scripting import get_request_builder
+
+
+@pytest.fixture
+def patched():
+    patch_threadlocal_manager()
+    yield
+    unpatch_threadlocal_manager()
+
+
+def test_push_pop(patched):
+    manager = threadlocal.manager
+    assert get_current_request() is None
+    manager.push({"request": "a", "registry": None})
+    manager.push({"request": "b", "registry": None})
+    assert get_current_request() == "b"
+    assert manager.pop()["request"] == "b"
+    assert get_current_request() == "a"
+    manager.clear()
+    assert get_current_request() is None
+    assert manager.pop() is None
+
+
+def test_isolated_between_threads(patched):
+    barrier = threading.Barrier(2)
+    seen = dict()
+
+    def run(name):
+        threadlocal.manager.push({"request": name, "registry": None})
+        barrier.wait()
+        seen[name] = get_current_request()
+        threadlocal.manager.pop()
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {"a": "a", "b": "b"}
+    assert get_current_request() is None
+
+
+def test_isolated_between_contexts(patched):
+    def run():
+        threadlocal.manager.push({"request": "a", "registry": None})
+        return get_current_request()
+
+    assert contextvars.copy_context().run(run) == "a"
+    assert get_current_request() is None
+
+
+@pytest.mark.parametrize("patch, isolated", [(True, True), (False, False)])
+def test_isolated_between_async_tasks(patch, isolated):
+    with _testConfig() as config:
+        config.include("pyramid_tasks")
+        builder = get_request_builder(config.registry)
+    seen = dict()
+
+    async def run(name):
+        request = builder.make_request()
+        with builder.prepare(request):
+            # Let the other task push its request onto the same thread.
+            await asyncio.sleep(0)
+            seen[name] = get_current_request() is request
+
+    async def main():
+        await asyncio.gather(run("a"), run("b"))
+
+    if patch:
+        patch_threadlocal_manager()
+    try:
+        asyncio.run(main())
+    finally:
+        unpatch_threadlocal_manager()
+    assert seen == {"a": isolated, "b": isolated}
+    assert get_current_request() is None
+
+
+def test_keeps_existing_stack():
+    threadlocal.manager.push({"request": "a", "registry": None})
+    try:
+        patch_threadlocal_manager()
+        assert get_current_request() == "a"
+        threadlocal.manager.push({"request": "b", "registry": None})
+        unpatch_threadlocal_manager()
+        assert get_current_request() == "b"
+        threadlocal.manager.pop()
+    finally:
+        unpatch_threadlocal_manager()
+        threadlocal.manager.pop()
+    assert get_current_request() is None
+
+
+class GreenPool:
+    is_green = True
+
+
+class Pool:
+    is_green = False
+
+
+def test_worker_init():
+    try:
+        _on_worker_init(sender=SimpleNamespace(pool_cls=Pool))
+        assert not is_patched()
+        _on_worker_init(sender=SimpleNamespace(pool_cls=GreenPool))
+        assert is_patched()
+    finally:
+        unpatch_threadlocal_manager()
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+import celery
+import pytest
+
+from pyramid_tasks.debounce import BackendDebounceStore, MemoryDebounceStore
+
+
+def test_memory_store():
+    store = MemoryDebounceStore()
+    with patch("time.monotonic", return_value=0):
+        assert store.add("foo", "a", 5) is None
+        assert store.add("foo", "b", 5) == "a"
+        assert store.add("bar", "c", 5) is None
+    with patch("time.monotonic", return_value=6):
+        assert store.add("foo", "d", 5) is None
+
+
+def test_memory_store_discard():
+    store = MemoryDebounceStore()
+    assert store.add("foo", "a", 5) is None
+    store.discard("foo", "b")
+    assert store.add("foo", "c", 5) == "a"
+    store.discard("foo", "a")
+    assert store.add("foo", "d", 5) is None
+
+
+def test_backend_store():
+    app = celery.Celery(set_as_current=False)
+    app.conf.result_backend = "cache+memory://"
+    store = BackendDebounceStore({"pyramid_tasks.app": app})
+    with patch("time.time", return_value=0):
+        assert store.add("foo", "a", 5) is None
+        assert store.add("foo", "b", 5) == "a"
+    with patch("time.time", return_value=6):
+        assert store.add("foo", "d", 5) is None
+        store.discard("foo", "b")
+        assert store.add("foo", "e", 5) == "d"
+        store.discard("foo", "d")
+        assert store.add("foo", "f", 5) is None
+
+
+def test_backend_store_unsupported():
+    app = celery.Celery(set_as_current=False)
+    app.conf.result_backend = "disabled://"
+    store = BackendDebounceStore({"pyramid_tasks.app": app})
+    with pytest.raises(NotImplementedError):
+        store.add("foo", "a", 5)
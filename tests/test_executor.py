@@ -0,0 +1,132 @@
+import gc
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import celery
+import pytest
+from celery.exceptions import TimeoutError
+
+from pyramid_tasks.executor import LocalExecutor, LocalResult, _get_delay
+
+
+@pytest.fixture
+def app():
+    return celery.Celery(set_as_current=False)
+
+
+@pytest.fixture
+def executor():
+    executor = LocalExecutor(max_workers=2, max_pending=2)
+    yield executor
+    executor.shutdown()
+
+
+def test_submit(app, executor):
+    @app.task(bind=True, shared=False)
+    def add(self, x, y):
+        return [x + y, self.request.headers["foo"]]
+
+    result = executor.submit(
+        add, (1, 2), {}, {"task_id": "abc", "headers": {"foo": "bar"}}
+    )
+    assert result.id == "abc"
+    assert result.get(timeout=5) == [3, "bar"]
+    assert result.state == "SUCCESS"
+    assert result.successful()
+    assert executor.result("abc") is result
+
+
+def test_result_kept(app):
+    executor = LocalExecutor(max_results=2, result_ttl=60)
+
+    @app.task(shared=False)
+    def add(x, y):
+        return x + y
+
+    try:
+        executor.submit(add, (1, 2), {}, {"task_id": "abc"}).get(timeout=5)
+        gc.collect()
+        assert executor.result("abc").result == 3
+        executor.submit(add, (2, 3), {}, {"task_id": "def"}).get(timeout=5)
+        executor.result("abc")
+        executor.submit(add, (3, 4), {}, {"task_id": "ghi"}).get(timeout=5)
+        assert executor.result("abc").result == 3
+        assert executor.result("ghi").result == 7
+        assert executor.result("def").state == "PENDING"
+    finally:
+        executor.shutdown()
+
+
+def test_result_expires(app):
+    executor = LocalExecutor(result_ttl=0)
+
+    @app.task(shared=False)
+    def add(x, y):
+        return x + y
+
+    try:
+        executor.submit(add, (1, 2), {}, {"task_id": "abc"}).get(timeout=5)
+        assert executor.result("abc").state == "PENDING"
+    finally:
+        executor.shutdown()
+
+
+def test_submit_failure(app, executor):
+    @app.task(shared=False)
+    def fail():
+        raise ValueError("oops")
+
+    result = executor.submit(fail, (), {}, {})
+    with pytest.raises(ValueError):
+        result.get(timeout=5)
+    assert result.failed()
+    assert isinstance(result.get(propagate=False), ValueError)
+    assert result.traceback
+
+
+def test_bounded(app, executor):
+    release = threading.Event()
+
+    @app.task(shared=False)
+    def block():
+        release.wait(5)
+
+    executor.submit(block, (), {}, {})
+    executor.submit(block, (), {}, {})
+    submitted = threading.Event()
+
+    def submit():
+        executor.submit(block, (), {}, {})
+        submitted.set()
+
+    threading.Thread(target=submit, daemon=True).start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(5)
+
+
+def test_countdown(app, executor):
+    @app.task(shared=False)
+    def now():
+        return time.monotonic()
+
+    start = time.monotonic()
+    result = executor.submit(now, (), {}, {"countdown": 0.1})
+    assert result.state == "PENDING"
+    assert result.get(timeout=5) - start >= 0.1
+
+
+def test_get_delay():
+    assert _get_delay({}) == 0
+    assert _get_delay({"countdown": 5}) == 5
+    eta = datetime.now(timezone.utc) + timedelta(seconds=10)
+    assert 9 < _get_delay({"eta": eta}) <= 10
+    assert 9 < _get_delay({"eta": eta.isoformat()}) <= 10
+
+
+def test_result_timeout():
+    result = LocalResult("abc")
+    assert not result.ready()
+    with pytest.raises(TimeoutError):
+        result.get(timeout=0.01)
@@ -1,16 +1,30 @@
+import asyncio
+import datetime
+import decimal
+import gc
+import time
 from contextlib import contextmanager
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import pytest
+import transaction
 from celery.contrib.testing.worker import start_worker
 from pyramid.scripting import prepare
 from pyramid.testing import testConfig as _testConfig
+from pyramid.threadlocal import get_current_request
 
 from pyramid_tasks import BeforeDeferTask
+from pyramid_tasks.contextlocals import unpatch_threadlocal_manager
 
 
 @pytest.fixture
 def test_config():
+    with make_test_config() as config:
+        yield config
+
+
+@contextmanager
+def make_test_config(extra_settings=None):
     settings = {
         "celery.worker_hijack_root_logger": False,
         "celery.worker_log_color": False,
@@ -20,6 +34,7 @@ def test_config():
         "celery.broker_url": "memory://",
         "celery.result_backend": "cache+memory://",
         "celery.broker_heartbeat": 0,
+        **(extra_settings or {}),
     }
     with _testConfig(settings=settings, autocommit=False) as config:
         config.include("pyramid_tasks")
@@ -35,8 +50,9 @@ def make_request_with_worker(config):
 
 
 @contextmanager
-def make_worker(config):
-    with start_worker(config.make_celery_app(), perform_ping_check=False):
+def make_worker(config, **kwargs):
+    app = config.make_celery_app()
+    with start_worker(app, perform_ping_check=False, **kwargs):
         yield None
 
 
@@ -146,13 +162,23 @@ def test_task_environ_integration(test_config):
     assert result == "bar"
 
 
-def test_transaction_integration(test_config):
+def test_transaction_integration(test_config, tmp_path):
+    test_config.add_settings(
+        {"sqlalchemy.url": f"sqlite:///{tmp_path / 'db.sqlite3'}"}
+    )
     test_config.include("tests.pkgs.transactionapp")
 
     with make_request_with_worker(test_config) as request:
         request.defer_task("increment", 1).get()
         request.defer_task("increment", 3).get()
         assert request.defer_task("total").get() == 4
+        total, task_id = request.defer_task("readonly_total", 10).get()
+        assert total == 14
+        request.get_task_result(task_id).get()
+        assert request.defer_task("total").get() == 14
+        # The debounce key is kept once the deferral has been published.
+        first = request.defer_task("readonly_debounce", 100).get()
+        assert request.defer_task("readonly_debounce", 100).get() == first
 
 
 def test_task_before_apply_integration(test_config):
@@ -170,3 +196,631 @@ def test_task_before_apply_integration(test_config):
     test_config.register_task(task)
     with make_request_with_worker(test_config) as request:
         assert request.defer_task(task).get() == "bar"
+
+
+def test_defer_tasks_integration(test_config):
+    events = []
+
+    def add_task(request, x, y=0):
+        return x + y
+
+    test_config.add_subscriber(events.append, BeforeDeferTask)
+    test_config.register_task(add_task, name="add")
+    with make_request_with_worker(test_config) as request:
+        app = test_config.make_celery_app()
+        send = app.amqp.send_task_message
+        with patch.object(app.amqp, "send_task_message", wraps=send) as mock:
+            results = request.defer_tasks(
+                [
+                    ("add", (1,)),
+                    (add_task, (2,), {"y": 3}),
+                    ("add", (4, 5), None, {"countdown": 0}),
+                ]
+            )
+        assert [result.get() for result in results] == [1, 5, 9]
+    assert len(events) == 3
+    assert len({call.args[0] for call in mock.call_args_list}) == 1
+
+
+def test_defer_after_commit_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.register_task(add_task, name="add")
+    with make_request_with_worker(test_config) as request:
+        manager = transaction.TransactionManager(explicit=True)
+        request.environ["tm.active"] = True
+        request.environ["tm.manager"] = manager
+        app = test_config.make_celery_app()
+        with patch.object(
+            app.amqp, "send_task_message", wraps=app.amqp.send_task_message
+        ) as mock:
+            with manager:
+                result = request.defer_task_with_options(
+                    "add", args=(2, 3), after_commit=True
+                )
+                immediate = request.defer_task("add", 1, 1)
+                assert mock.call_count == 1
+            assert mock.call_count == 2
+            assert result.get() == 5
+            assert immediate.get() == 2
+
+            manager.begin()
+            request.defer_task_with_options(
+                "add", args=(2, 3), after_commit=True
+            )
+            manager.abort()
+            assert mock.call_count == 2
+
+
+def test_defer_tasks_shared_options_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.register_task(add_task, name="add")
+    with make_request_with_worker(test_config) as request:
+        manager = transaction.TransactionManager(explicit=True)
+        request.environ["tm.active"] = True
+        request.environ["tm.manager"] = manager
+        options = {"after_commit": True}
+        with manager:
+            results = request.defer_tasks(
+                [
+                    ("add", (1, 2), None, options),
+                    ("add", (3, 4), None, options),
+                ]
+            )
+            assert all(r.state == "PENDING" for r in results)
+        assert options == {"after_commit": True}
+        assert results[0].id != results[1].id
+        assert [r.get() for r in results] == [3, 7]
+
+
+def test_defer_after_commit_setting_integration():
+    def add_task(request, x, y):
+        return x + y
+
+    settings = {"pyramid_tasks.after_commit": "true"}
+    with make_test_config(settings) as config:
+        config.register_task(add_task, name="add")
+        with make_request_with_worker(config) as request:
+            manager = transaction.TransactionManager(explicit=True)
+            request.environ["tm.active"] = True
+            request.environ["tm.manager"] = manager
+            with manager:
+                results = request.defer_tasks(
+                    [("add", (1, 2)), ("add", (3, 4))]
+                )
+                assert all(r.state == "PENDING" for r in results)
+            assert [r.get() for r in results] == [3, 7]
+            # No transaction, so published immediately
+            del request.environ["tm.active"]
+            assert request.defer_task("add", 1, 1).get() == 2
+
+
+def test_get_task_results_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    def fail_task(request):
+        raise ValueError("fail")
+
+    test_config.register_task(add_task, name="add")
+    test_config.register_task(fail_task, name="fail")
+    with make_request_with_worker(test_config) as request:
+        first = request.defer_task("add", 2, 3)
+        second = request.defer_task("fail")
+        first.get()
+        with pytest.raises(ValueError):
+            second.get()
+        app = test_config.make_celery_app()
+        app.backend._cache.clear()
+        with patch.object(app.backend, "get", side_effect=AssertionError):
+            results = request.get_task_results([first.id, second.id, "foo"])
+    assert results[first.id] == ("SUCCESS", 5)
+    assert results[second.id].state == "FAILURE"
+    assert isinstance(results[second.id].result, ValueError)
+    assert results["foo"] == ("PENDING", None)
+
+
+def test_metrics_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.include("pyramid_tasks.contrib.metrics")
+    test_config.register_task(add_task, name="add")
+    with make_request_with_worker(test_config) as request:
+        assert request.defer_task("add", 2, 3).get() == 5
+    text = test_config.registry["pyramid_tasks.metrics"].render()
+    for metric in ("queue_wait", "setup", "run"):
+        assert f'pyramid_tasks_{metric}_seconds_count{{task="add"}} 1' in text
+    assert 'completed_total{task="add",outcome="success"} 1' in text
+
+
+def test_get_task_result_cache_integration():
+    def add_task(request, x, y):
+        return x + y
+
+    settings = {"pyramid_tasks.result_cache.max_size": "10"}
+    with make_test_config(settings) as config:
+        config.register_task(add_task, name="add")
+        with make_request_with_worker(config) as request:
+            task_id = request.defer_task("add", 2, 3).id
+            assert request.get_task_result(task_id).get() == 5
+            cache = config.registry["pyramid_tasks.result_cache"]
+            assert (cache.hits, cache.misses) == (0, 1)
+            backend = config.make_celery_app().backend
+            with patch.object(backend, "get", side_effect=AssertionError):
+                result = request.get_task_result(task_id)
+                assert result.state == "SUCCESS"
+                assert result.get() == 5
+            assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lazy_derivation_integration():
+    calls = []
+
+    def counting_deriver(task, info):
+        calls.append(info.name)
+        return task
+
+    def add_task(request, x, y):
+        return x + y
+
+    settings = {"pyramid_tasks.lazy_derivation": "true"}
+    with make_test_config(settings) as config:
+        config.add_task_deriver(counting_deriver)
+        config.register_task(add_task, name="add")
+        with make_request_with_worker(config) as request:
+            assert calls == []
+            assert request.defer_task("add", 2, 3).get() == 5
+            assert request.defer_task("add", 2, 3).get() == 5
+    assert calls == ["add"]
+
+
+def test_defer_task_once_integration(test_config):
+    events = []
+
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.add_subscriber(events.append, BeforeDeferTask)
+    test_config.register_task(add_task, name="add")
+    with make_request_with_worker(test_config) as request:
+        app = test_config.make_celery_app()
+        send = app.amqp.send_task_message
+        with patch.object(app.amqp, "send_task_message", wraps=send) as mock:
+            first = request.defer_task_once("add", 1, 2)
+            second = request.defer_task_once(add_task, 1, 2)
+            third = request.defer_task_with_options(
+                "add", args=(1,), kwargs={"y": 3}, coalesce=True
+            )
+            (fourth,) = request.defer_tasks(
+                [("add", (1,), {"y": 3}, {"coalesce": True})]
+            )
+            assert mock.call_count == 0
+            request._process_finished_callbacks()
+            assert mock.call_count == 2
+        assert first is second
+        assert third is fourth
+        assert first.get() == 3
+        assert third.get() == 4
+    assert len(events) == 2
+
+
+def test_debounce_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.register_task(add_task, name="add")
+    test_config.register_task(
+        add_task, name="add_x", debounce=60, debounce_key=lambda x, y: str(x)
+    )
+    with make_request_with_worker(test_config) as request:
+        first = request.defer_task_with_options(
+            "add", args=(1, 2), debounce=0.1
+        )
+        second = request.defer_task_with_options(
+            "add", args=(1, 2), debounce=0.1
+        )
+        other = request.defer_task_with_options(
+            "add", args=(1, 3), debounce=0.1
+        )
+        assert first.id == second.id
+        assert first.id != other.id
+        assert first.get() == 3
+        assert other.get() == 4
+        third = request.defer_task_with_options(
+            "add", args=(1, 2), debounce=0.1
+        )
+        assert third.id != first.id
+        assert third.get() == 3
+
+        by_key = request.defer_task("add_x", 1, 2)
+        assert request.defer_task("add_x", 1, 5).id == by_key.id
+        assert request.defer_tasks([("add_x", (1, 6))])[0].id == by_key.id
+        assert request.defer_task("add_x", 2, 5).id != by_key.id
+
+
+def test_debounce_after_abort_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.register_task(add_task, name="add", debounce=60)
+    with make_request_with_worker(test_config) as request:
+        manager = transaction.TransactionManager(explicit=True)
+        request.environ["tm.active"] = True
+        request.environ["tm.manager"] = manager
+        manager.begin()
+        aborted = request.defer_task_with_options(
+            "add", args=(1, 2), after_commit=True
+        )
+        manager.abort()
+        with manager:
+            result = request.defer_task_with_options(
+                "add", args=(1, 2), after_commit=True, countdown=0
+            )
+        assert result.id != aborted.id
+        assert result.get() == 3
+
+
+def test_batch_task_integration(test_config):
+    batches = list()
+
+    def record_task(request, items):
+        batches.append((request, items))
+
+    test_config.register_batch_task(
+        record_task, name="record", flush_every=3, flush_interval=0.2
+    )
+    with make_request_with_worker(test_config) as request:
+        results = [request.defer_task("record", i) for i in range(4)]
+        for result in results:
+            result.get()
+        deadline = time.monotonic() + 5
+        while len(batches) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    assert [items for _, items in batches] == [[0, 1, 2], [3]]
+    assert batches[0][0] is not batches[1][0]
+
+
+def test_serializer_integration():
+    pytest.importorskip("msgpack")
+    settings = {
+        "celery.task_serializer": "pyramid_msgpack",
+        "celery.result_serializer": "pyramid_msgpack",
+        "celery.accept_content": "pyramid_msgpack",
+        "pyramid_tasks.serializer.compress_threshold": "64",
+    }
+
+    def echo_task(request, value):
+        return value
+
+    value = {
+        "amount": decimal.Decimal("9.99"),
+        "when": datetime.datetime(2020, 1, 1, 12, 30),
+        "data": b"x" * 100,
+    }
+    with make_test_config(settings) as config:
+        config.register_task(echo_task, name="echo")
+        with make_request_with_worker(config) as request:
+            assert request.defer_task("echo", value).get() == value
+
+
+def test_claim_check_integration(tmp_path):
+    settings = {
+        "pyramid_tasks.claim_check.threshold": "100",
+        "pyramid_tasks.claim_check.directory": str(tmp_path),
+    }
+
+    def upper_task(request, data, prefix=""):
+        assert isinstance(data, memoryview) == (len(data) > 100)
+        return prefix + bytes(data).decode().upper()
+
+    def echo_task(request, value):
+        return value
+
+    with make_test_config(settings) as config:
+        config.register_task(upper_task, name="upper")
+        config.register_task(echo_task, name="echo")
+        with make_request_with_worker(config) as request:
+            forged = {"__claim_check__": ["str", "/etc/hostname"]}
+            assert request.defer_task("echo", forged).get() == forged
+            result = request.defer_task("upper", b"a" * 200, prefix="b")
+            assert result.get() == "b" + "A" * 200
+            assert request.get_task_results([result.id]) == {
+                result.id: ("SUCCESS", "b" + "A" * 200)
+            }
+            assert request.defer_task("upper", b"c" * 50).get() == "C" * 50
+    assert len(list(tmp_path.rglob("*"))) == 4  # Two directories and blobs
+
+
+def test_claim_check_result_cache_integration(tmp_path):
+    settings = {
+        "pyramid_tasks.claim_check.threshold": "100",
+        "pyramid_tasks.claim_check.directory": str(tmp_path),
+        "pyramid_tasks.result_cache.max_size": "10",
+    }
+
+    def echo_task(request, value):
+        return value
+
+    with make_test_config(settings) as config:
+        config.register_task(echo_task, name="echo")
+        with make_request_with_worker(config) as request:
+            forged = {"__claim_check__": ["str", "/etc/hostname"]}
+            large = "a" * 200
+            ids = [
+                request.defer_task("echo", value).id
+                for value in (forged, large)
+            ]
+            expected = [forged, large]
+            for _ in range(2):
+                assert [
+                    request.get_task_result(task_id).get(timeout=10)
+                    for task_id in ids
+                ] == expected
+                assert [
+                    state.result
+                    for state in request.get_task_results(ids).values()
+                ] == expected
+            cache = config.registry["pyramid_tasks.result_cache"]
+            assert cache.hits
+
+
+def test_task_context_integration():
+    settings = {"pyramid_tasks.context": "host_url traceparent"}
+
+    def context_task(request):
+        return dict(request.task_context)
+
+    with make_test_config(settings) as config:
+        config.add_task_context_propagator(
+            "tenant",
+            lambda request: request.environ.get("tenant"),
+            lambda request, value: value.upper(),
+        )
+        config.register_task(context_task, name="context")
+        with make_request_with_worker(config) as request:
+            request.environ["tenant"] = "acme"
+            request.headers["traceparent"] = "00-abc-def-01"
+            assert request.defer_task("context").get() == {
+                "host_url": "http://localhost",
+                "traceparent": "00-abc-def-01",
+                "tenant": "ACME",
+            }
+
+
+@pytest.mark.parametrize("contextvars", ["true", "false"])
+def test_concurrent_threads_integration(contextvars):
+    def check_task(request, i):
+        time.sleep(0.02)
+        return (
+            get_current_request() is request
+            and request.current_task.request.args == [i]
+        )
+
+    settings = {"pyramid_tasks.contextvars": contextvars}
+    try:
+        with make_test_config(settings) as config:
+            config.register_task(check_task, name="check")
+            config.commit()
+            with prepare(registry=config.registry) as env:
+                request = env["request"]
+                with make_worker(config, pool="threads", concurrency=8):
+                    results = [
+                        request.defer_task("check", i) for i in range(40)
+                    ]
+                    assert all(result.get(timeout=10) for result in results)
+    finally:
+        unpatch_threadlocal_manager()
+
+
+def test_async_task_integration(test_config):
+    async def async_task(request, x, y):
+        await asyncio.sleep(0)
+        assert get_current_request() is request
+        assert request.current_task.request.args == [x, y]
+        return [x + y, id(asyncio.get_running_loop())]
+
+    def async_deriver(task, info):
+        async def wrapped(request, *args, **kwargs):
+            result = await task(request, *args, **kwargs)
+            return [*result, info.is_async]
+
+        return wrapped if info.is_async else task
+
+    test_config.add_task_deriver(async_deriver)
+    test_config.register_task(async_task, name="async_add")
+    with make_request_with_worker(test_config) as request:
+        first = request.defer_task("async_add", 1, 2).get()
+        second = request.defer_task("async_add", 3, 4).get()
+    assert first[0] == 3
+    assert second[0] == 7
+    assert first[1] == second[1]
+    assert first[2] is True
+
+
+def test_local_executor_integration():
+    def check_task(request, x):
+        assert get_current_request() is request
+        return [x, request.current_task.request.id, request.task_context]
+
+    settings = {
+        "pyramid_tasks.executor": "local",
+        "pyramid_tasks.context": "host_url",
+    }
+    with make_test_config(settings) as config:
+        config.register_task(check_task, name="check")
+        config.commit()
+        with prepare(registry=config.registry) as env:
+            request = env["request"]
+            result = request.defer_task("check", 1)
+            assert result.get(timeout=5) == [
+                1,
+                result.id,
+                {"host_url": "http://localhost"},
+            ]
+            manager = transaction.TransactionManager(explicit=True)
+            request.environ["tm.active"] = True
+            request.environ["tm.manager"] = manager
+            with manager:
+                held = request.defer_task_with_options(
+                    "check", args=(2,), after_commit=True
+                )
+                assert held.state == "PENDING"
+            assert held.get(timeout=5)[0] == 2
+            task_id = result.id
+            del result, held
+            gc.collect()
+            found = request.get_task_result(task_id)
+            assert found.state == "SUCCESS"
+            assert found.result[0] == 1
+            assert request.get_task_results([task_id])[task_id] == (
+                "SUCCESS",
+                found.result,
+            )
+            assert [
+                s.state for _, s in request.iter_task_results([task_id])
+            ] == ["SUCCESS"]
+
+
+def test_adaptive_routing_integration():
+    def queue_task(request, delay):
+        time.sleep(delay)
+        return request.current_task.request.delivery_info["routing_key"]
+
+    settings = {
+        "pyramid_tasks.routes.fast": "express",
+        "pyramid_tasks.routing.slow_queue": "slow",
+        "pyramid_tasks.routing.threshold": "0.05",
+        "pyramid_tasks.routing.min_samples": "2",
+        "pyramid_tasks.routing.cache_ttl": "0",
+        "pyramid_tasks.routing.report_interval": "0",
+        "pyramid_tasks.routing.store": "memory",
+    }
+    with make_test_config(settings) as config:
+        config.register_task(queue_task, name="fast")
+        config.register_task(queue_task, name="slow")
+        config.commit()
+        with prepare(registry=config.registry) as env:
+            request = env["request"]
+            queues = ["celery", "express", "slow"]
+            with make_worker(config, queues=queues):
+                assert request.defer_task("fast", 0).get() == "express"
+                assert request.defer_task("slow", 0.1).get() == "celery"
+                assert request.defer_task("slow", 0.1).get() == "celery"
+                assert request.defer_task("slow", 0).get() == "slow"
+
+
+def test_sharded_periodic_task_integration(test_config):
+    def shard_task(request, scale, shard, shards):
+        return [shard, shards, scale]
+
+    def total_task(request, results):
+        return sorted(results)
+
+    test_config.register_task(shard_task, name="shard")
+    test_config.register_task(total_task, name="total")
+    test_config.add_periodic_task(60, "shard", (2,), shards=3, name="plain")
+    test_config.add_periodic_task(
+        60,
+        "shard",
+        kwargs={"scale": 3},
+        partition=lambda request, shards: [[0, 5], [5, 10]],
+        callback="total",
+        name="ranges",
+    )
+    with make_request_with_worker(test_config) as request:
+        ids = request.defer_task("pyramid_tasks.fan_out", "plain").get()
+        app = test_config.registry["pyramid_tasks.app"]
+        assert [app.AsyncResult(id).get() for id in ids] == [
+            [0, 3, 2],
+            [1, 3, 2],
+            [2, 3, 2],
+        ]
+        callback_id = request.defer_task("pyramid_tasks.fan_out", "ranges")
+        assert app.AsyncResult(callback_id.get()).get(timeout=10) == [
+            [[0, 5], 2, 3],
+            [[5, 10], 2, 3],
+        ]
+
+
+def test_defer_map_integration(test_config):
+    def square_task(request, x):
+        return [x * x, request.current_task.request.id]
+
+    async def async_square_task(request, x):
+        await asyncio.sleep(0)
+        return x * x
+
+    test_config.register_task(square_task, name="square")
+    test_config.register_task(async_square_task, name="async_square")
+    with make_request_with_worker(test_config) as request:
+        results = request.defer_map(
+            "square", (x for x in range(5)), chunk_size=3, max_in_flight=1
+        )
+        chunks = [result.get() for result in results]
+        assert [[x for x, _ in chunk] for chunk in chunks] == [
+            [0, 1, 4],
+            [9, 16],
+        ]
+        assert chunks[0][0][1] == results[0].id
+        results = request.defer_map("async_square", range(3))
+        assert results[0].get() == [0, 1, 4]
+
+
+def test_defer_map_routing_integration():
+    def queue_task(request, x):
+        return request.current_task.request.delivery_info["routing_key"]
+
+    settings = {"pyramid_tasks.routes.routed": "express"}
+    with make_test_config(settings) as config:
+        config.register_task(queue_task, name="routed")
+        config.register_task(queue_task, name="queued", queue="maps")
+        config.commit()
+        with prepare(registry=config.registry) as env:
+            request = env["request"]
+            queues = ["celery", "express", "maps", "other"]
+            with make_worker(config, queues=queues):
+                (result,) = request.defer_map("routed", [1])
+                assert result.get(timeout=10) == ["express"]
+                (result,) = request.defer_map("queued", [1])
+                assert result.get(timeout=10) == ["maps"]
+                (result,) = request.defer_map("queued", [1], queue="other")
+                assert result.get(timeout=10) == ["other"]
+
+
+def test_iter_task_results_integration(test_config):
+    def sleep_task(request, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    test_config.register_task(sleep_task, name="sleep")
+    test_config.commit()
+    with prepare(registry=test_config.registry) as env:
+        request = env["request"]
+        with make_worker(test_config, pool="threads", concurrency=3):
+            results = [request.defer_task("sleep", s) for s in (0.6, 0.3, 0)]
+            finished = [
+                task_state.result
+                for _, task_state in request.iter_task_results(
+                    results, timeout=10, interval=0.05
+                )
+            ]
+            assert finished == [0, 0.3, 0.6]
+
+
+def test_memory_integration(test_config):
+    def add_task(request, x, y):
+        return x + y
+
+    test_config.include("pyramid_tasks.contrib.metrics")
+    test_config.include("pyramid_tasks.contrib.memory")
+    test_config.register_task(add_task, name="add")
+    with make_request_with_worker(test_config) as request:
+        assert request.defer_task("add", 2, 3).get() == 5
+    snapshot = test_config.registry["pyramid_tasks.memory"].snapshot()
+    assert snapshot["add"]["count"] == 1
+    text = test_config.registry["pyramid_tasks.metrics"].render()
+    assert 'pyramid_tasks_memory_growth_bytes_total{task="add"}' in text
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+from pyramid.scripting import prepare
+from pyramid.testing import testConfig as _testConfig
+
+
+@pytest.fixture
+def config():
+    settings = {
+        "pyramid_tasks.executor": "local",
+        "pyramid_tasks.executor.max_workers": "2",
+    }
+    with _testConfig(settings=settings, autocommit=False) as config:
+        config.include("pyramid_tasks")
+        yield config
+
+
+def test_defer_map(config):
+    requests = list()
+
+    def double(request, x):
+        requests.append(request)
+        return x * 2
+
+    config.register_task(double, name="double")
+    config.commit()
+    with prepare(registry=config.registry) as env:
+        results = env["request"].defer_map(double, range(5), chunk_size=2)
+        assert [result.get(timeout=5) for result in results] == [
+            [0, 2],
+            [4, 6],
+            [8],
+        ]
+    assert requests[0] is requests[1]
+    assert requests[1] is not requests[2]
+
+
+def test_defer_map_lazy(config):
+    release = threading.Event()
+    consumed = list()
+
+    def wait(request, x):
+        release.wait(5)
+
+    def generate():
+        for i in range(10):
+            consumed.append(i)
+            yield i
+
+    config.register_task(wait, name="wait")
+    config.commit()
+    with prepare(registry=config.registry) as env:
+        thread = threading.Thread(
+            target=env["request"].defer_map,
+            args=(wait, generate()),
+            kwargs={"chunk_size": 2, "max_in_flight": 2},
+            daemon=True,
+        )
+        thread.start()
+        thread.join(0.2)
+        # Two chunks in flight, and the third waiting.
+        assert consumed == [0, 1, 2, 3, 4, 5]
+        release.set()
+        thread.join(5)
+        assert len(consumed) == 10
+
+
+def test_defer_map_batch_task(config):
+    config.register_batch_task(lambda request, items: None, name="batch")
+    config.commit()
+    with prepare(registry=config.registry) as env:
+        with pytest.raises(ValueError):
+            env["request"].defer_map("batch", range(5))
+
+
+def test_defer_map_deriver_name(config):
+    names = list()
+
+    def record_deriver(task, info):
+        names.append(info.name)
+        return task
+
+    config.add_task_deriver(record_deriver)
+    config.register_task(lambda request, x: x, name="identity")
+    config.commit()
+    with prepare(registry=config.registry) as env:
+        (result,) = env["request"].defer_map("identity", range(2))
+        assert result.get(timeout=5) == [0, 1]
+    assert "identity.chunk" in names
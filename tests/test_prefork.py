@@ -0,0 +1,63 @@
+import gc
+from unittest.mock import patch
+
+import pytest
+from celery import signals
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks import CeleryWorkerInit
+from pyramid_tasks.prefork import memory_usage
+
+SMAPS = """\
+55d0c0000000-7ffd00000000 ---p 00000000 00:00 0    [rollup]
+Rss:               10240 kB
+Pss:                6144 kB
+Shared_Clean:       4096 kB
+Shared_Dirty:       2048 kB
+Private_Clean:      1024 kB
+Private_Dirty:      3072 kB
+"""
+
+
+@pytest.fixture
+def config():
+    settings = {"pyramid_tasks.prefork_preload": "true"}
+    with _testConfig(settings=settings, autocommit=False) as config:
+        config.include("pyramid_tasks")
+        yield config
+
+
+@pytest.fixture(autouse=True)
+def unfreeze():
+    yield
+    if hasattr(gc, "unfreeze"):
+        gc.unfreeze()
+
+
+def test_worker_init(config):
+    events = []
+    config.add_subscriber(events.append, CeleryWorkerInit)
+    config.commit()
+    app = config.make_celery_app()
+    with patch.object(app.loader, "import_default_modules") as import_mock:
+        signals.worker_init.send(sender=None)
+    assert [event.registry for event in events] == [config.registry]
+    import_mock.assert_called_once_with()
+    if hasattr(gc, "freeze"):
+        assert gc.get_freeze_count() > 0
+
+
+def test_memory_usage(tmp_path):
+    path = tmp_path / "smaps_rollup"
+    path.write_text(SMAPS)
+    with patch("pyramid_tasks.prefork.SMAPS_ROLLUP", str(path)):
+        assert memory_usage() == {
+            "rss": 10240 * 1024,
+            "shared": 6144 * 1024,
+            "private": 4096 * 1024,
+        }
+
+
+def test_memory_usage_unavailable(tmp_path):
+    with patch("pyramid_tasks.prefork.SMAPS_ROLLUP", str(tmp_path / "nope")):
+        assert memory_usage() is None
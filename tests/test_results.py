@@ -0,0 +1,161 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from celery.exceptions import TimeoutError
+from pyramid.testing import DummyRequest
+
+from pyramid_tasks.results import (
+    ResultCache,
+    get_task_results,
+    iter_task_results,
+)
+
+
+def make_request(backend, cache=None):
+    request = DummyRequest()
+    request.registry["pyramid_tasks.app"] = Mock(backend=backend)
+    request.registry["pyramid_tasks.result_cache"] = cache
+    request.registry["pyramid_tasks.claim_check"] = None
+    request.registry["pyramid_tasks.executor"] = None
+    return request
+
+
+def test_get_task_results_fallback():
+    metas = {
+        "a": {"status": "SUCCESS", "result": 1},
+        "b": {"status": "STARTED", "result": None},
+    }
+    backend = Mock(spec=["get_task_meta"])
+    backend.get_task_meta.side_effect = metas.__getitem__
+    results = get_task_results(make_request(backend), ["a", "b"])
+    assert results == {"a": ("SUCCESS", 1), "b": ("STARTED", None)}
+
+
+def test_get_task_results_cached():
+    backend = Mock(spec=["_cache", "mget"])
+    backend._cache = {"a": {"status": "SUCCESS", "result": 1}}
+    results = get_task_results(make_request(backend), ["a"])
+    assert results == {"a": ("SUCCESS", 1)}
+    backend.mget.assert_not_called()
+
+
+def test_get_task_results_result_cache():
+    cache = ResultCache(max_size=10, ttl=60)
+    cache.set("a", {"status": "SUCCESS", "result": 1})
+    backend = Mock(spec=["get_task_meta"])
+    backend.get_task_meta.return_value = {"status": "FAILURE", "result": 2}
+    results = get_task_results(make_request(backend, cache), ["a", "b"])
+    assert results == {"a": ("SUCCESS", 1), "b": ("FAILURE", 2)}
+    backend.get_task_meta.assert_called_once_with("b")
+    assert cache.get("b") == {"status": "FAILURE", "result": 2}
+
+
+def test_iter_task_results_polled():
+    metas = {
+        "a": [
+            {"status": "STARTED", "result": None},
+            {"status": "STARTED", "result": None},
+            {"status": "SUCCESS", "result": 1},
+        ],
+        "b": [
+            {"status": "STARTED", "result": None},
+            {"status": "FAILURE", "result": 2},
+        ],
+        "c": [{"status": "SUCCESS", "result": 3}],
+    }
+    backend = Mock(spec=["get_task_meta"])
+    backend.get_task_meta.side_effect = lambda task_id: metas[task_id].pop(0)
+    results = iter_task_results(
+        make_request(backend), ["a", Mock(id="b"), "c"], interval=0
+    )
+    assert list(results) == [
+        ("c", ("SUCCESS", 3)),
+        ("b", ("FAILURE", 2)),
+        ("a", ("SUCCESS", 1)),
+    ]
+    assert backend.get_task_meta.call_count == 6
+
+
+def test_iter_task_results_timeout():
+    backend = Mock(spec=["get_task_meta"])
+    backend.get_task_meta.return_value = {"status": "PENDING", "result": None}
+    results = iter_task_results(
+        make_request(backend), ["a"], timeout=0.05, interval=0.01
+    )
+    with pytest.raises(TimeoutError):
+        list(results)
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+        self.channels = None
+        self.closed = False
+
+    def subscribe(self, *channels):
+        self.channels = channels
+
+    def get_message(self, timeout):
+        if self.messages:
+            return self.messages.pop(0)
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def test_iter_task_results_subscribed():
+    pubsub = FakePubSub(
+        [
+            {"type": "message", "channel": b"meta-b", "data": "STARTED"},
+            {"type": "message", "channel": b"meta-x", "data": "SUCCESS"},
+            {"type": "message", "channel": b"meta-b", "data": "SUCCESS"},
+        ]
+    )
+    backend = Mock(spec=["get_task_meta", "get_key_for_task", "client"])
+    backend.get_task_meta.side_effect = lambda task_id: {
+        "status": "SUCCESS" if task_id == "a" else "PENDING",
+        "result": task_id,
+    }
+    backend.get_key_for_task = lambda task_id: f"meta-{task_id}".encode()
+    backend.decode_result = lambda data: {"status": data, "result": 2}
+    backend.meta_from_decoded = lambda meta: meta
+    backend.client.pubsub.return_value = pubsub
+    with patch("pyramid_tasks.results._is_redis", return_value=True):
+        results = iter_task_results(make_request(backend), ["a", "b"])
+        assert list(results) == [
+            ("a", ("SUCCESS", "a")),
+            ("b", ("SUCCESS", 2)),
+        ]
+    assert pubsub.channels == ("meta-a", "meta-b")
+    assert pubsub.closed
+
+
+class TestResultCache:
+    def test_ready_only(self):
+        cache = ResultCache(max_size=10, ttl=60)
+        cache.set("a", {"status": "STARTED", "result": None})
+        assert cache.get("a") is None
+        assert (cache.hits, cache.misses) == (0, 1)
+
+    def test_eviction(self):
+        cache = ResultCache(max_size=2, ttl=60)
+        cache.set("a", {"status": "SUCCESS"})
+        cache.set("b", {"status": "SUCCESS"})
+        cache.get("a")
+        cache.set("c", {"status": "SUCCESS"})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert len(cache) == 2
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_ttl(self):
+        cache = ResultCache(max_size=10, ttl=60)
+        with patch("time.monotonic", return_value=0):
+            cache.set("a", {"status": "SUCCESS"})
+        with patch("time.monotonic", return_value=59):
+            assert cache.get("a") is not None
+        with patch("time.monotonic", return_value=61):
+            assert cache.get("a") is None
+        assert len(cache) == 0
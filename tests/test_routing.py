@@ -0,0 +1,112 @@
+from unittest.mock import Mock, patch
+
+import celery
+import pytest
+
+from pyramid_tasks.routing import (
+    BUCKETS,
+    AdaptiveRouter,
+    BackendRuntimeStore,
+    MemoryRuntimeStore,
+    RuntimeRecorder,
+    get_percentile,
+)
+
+
+def make_counts(**indexes):
+    counts = [0] * (len(BUCKETS) + 1)
+    for index, count in indexes.items():
+        counts[int(index[1:])] = count
+    return counts
+
+
+def test_get_percentile():
+    assert get_percentile(make_counts(), 95) is None
+    counts = make_counts(i0=94, i9=6)
+    assert get_percentile(counts, 50) == BUCKETS[0]
+    assert get_percentile(counts, 95) == BUCKETS[9]
+    assert get_percentile(make_counts(i16=1), 95) == float("inf")
+
+
+def test_memory_store():
+    store = MemoryRuntimeStore(window=10)
+    with patch("time.time", return_value=5):
+        assert store.get("foo") is None
+        store.add("foo", make_counts(i0=1))
+        store.add("foo", make_counts(i0=1, i1=1))
+    with patch("time.time", return_value=15):
+        store.add("foo", make_counts(i2=1))
+        assert store.get("foo") == make_counts(i0=2, i1=1, i2=1)
+    with patch("time.time", return_value=25):
+        assert store.get("foo") == make_counts(i2=1)
+
+
+def test_backend_store():
+    app = celery.Celery(set_as_current=False)
+    app.conf.result_backend = "cache+memory://"
+    store = BackendRuntimeStore({"pyramid_tasks.app": app}, window=10)
+    with patch("time.time", return_value=5):
+        assert store.get("foo") is None
+        store.add("foo", make_counts(i0=1))
+        store.add("foo", make_counts(i0=1, i1=1))
+        assert store.get("foo") == make_counts(i0=2, i1=1)
+        assert store.get("bar") is None
+
+
+def test_backend_store_unsupported():
+    app = celery.Celery(set_as_current=False)
+    app.conf.result_backend = "disabled://"
+    store = BackendRuntimeStore({"pyramid_tasks.app": app})
+    with pytest.raises(NotImplementedError):
+        store.get("foo")
+
+
+def test_router_overrides():
+    router = AdaptiveRouter(None, overrides={"foo": "bar"})
+    assert router("foo", (), {}, {}) == {"queue": "bar"}
+    assert router("baz", (), {}, {}) is None
+
+
+def test_router_adaptive():
+    store = MemoryRuntimeStore()
+    router = AdaptiveRouter(
+        store, slow_queue="slow", threshold=1.0, min_samples=10, cache_ttl=0
+    )
+    store.add("foo", make_counts(i10=9))
+    assert router("foo", (), {}, {}) is None
+    store.add("foo", make_counts(i10=1))
+    assert router("foo", (), {}, {}) == {"queue": "slow"}
+    store.add("bar", make_counts(i0=95, i10=5))
+    assert router("bar", (), {}, {}) is None
+
+
+def test_router_cache():
+    store = Mock(get=Mock(return_value=make_counts(i10=20)))
+    router = AdaptiveRouter(store, slow_queue="slow", cache_ttl=60)
+    with patch("time.monotonic", return_value=0):
+        assert router("foo", (), {}, {}) == {"queue": "slow"}
+        assert router("foo", (), {}, {}) == {"queue": "slow"}
+    assert store.get.call_count == 1
+    with patch("time.monotonic", return_value=61):
+        router("foo", (), {}, {})
+    assert store.get.call_count == 2
+
+
+def test_router_store_error():
+    store = Mock(get=Mock(side_effect=ConnectionError))
+    router = AdaptiveRouter(store, slow_queue="slow")
+    assert router("foo", (), {}, {}) is None
+
+
+def test_recorder():
+    store = MemoryRuntimeStore()
+    recorder = RuntimeRecorder(store, report_interval=10)
+    with patch("time.monotonic", return_value=0):
+        recorder._last_report = 0
+        recorder.observe("foo", 0.0005)
+        recorder.observe("foo", 2.0)
+        recorder.maybe_report()
+    assert store.get("foo") is None
+    with patch("time.monotonic", return_value=10):
+        recorder.maybe_report()
+    assert store.get("foo") == make_counts(i0=1, i10=1)
@@ -0,0 +1,71 @@
+import pytest
+from pyramid.interfaces import IRequest
+from pyramid.testing import testConfig as _testConfig
+from pyramid.threadlocal import get_current_request
+
+from pyramid_tasks.scripting import RequestBuilder
+
+
+@pytest.fixture
+def config():
+    with _testConfig(autocommit=False) as config:
+        yield config
+
+
+def make_builder(config):
+    config.commit()
+    return RequestBuilder(config.registry)
+
+
+def test_make_request(config):
+    builder = make_builder(config)
+    request = builder.make_request()
+    assert request.path == "/"
+    assert request.host == "localhost:80"
+    assert request.registry is config.registry
+    assert request.body == b""
+
+
+def test_make_request_environ(config):
+    builder = make_builder(config)
+    request = builder.make_request({"foo": "bar", "HTTP_HOST": "example.com"})
+    assert request.environ["foo"] == "bar"
+    assert request.host == "example.com"
+    assert "foo" not in builder.make_request().environ
+
+
+def test_request_extensions(config):
+    config.add_request_method(lambda req, x: x * 2, "double")
+    config.add_request_method(lambda req: object(), "thing", reify=True)
+    config.add_request_method(lambda req: object(), "prop", property=True)
+    builder = make_builder(config)
+
+    first = builder.make_request()
+    second = builder.make_request()
+    assert first.double(2) == 4
+    assert first.thing is first.thing
+    assert first.thing is not second.thing
+    assert first.prop is not first.prop
+    assert first.__class__ is second.__class__
+    assert IRequest.providedBy(first)
+
+
+def test_prepare(config):
+    builder = make_builder(config)
+    request = builder.make_request()
+    called = []
+    request.add_finished_callback(called.append)
+    with builder.prepare(request):
+        assert get_current_request() is request
+        assert request.context is not None
+    assert get_current_request() is not request
+    assert called == [request]
+
+
+def test_prepare_exception(config):
+    builder = make_builder(config)
+    request = builder.make_request()
+    with pytest.raises(ValueError):
+        with builder.prepare(request):
+            raise ValueError()
+    assert get_current_request() is not request
@@ -0,0 +1,100 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+pytest.importorskip("msgpack")
+
+from kombu import serialization
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks.serializers import (
+    CONTENT_TYPE,
+    SERIALIZER_NAME,
+    TaskSerializer,
+)
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+@pytest.fixture
+def config():
+    with _testConfig(autocommit=False) as config:
+        config.include("pyramid_tasks")
+        yield config
+
+
+def test_round_trip(config):
+    config.commit()
+    serializer = config.registry["pyramid_tasks.serializer"]
+    value = {
+        "when": datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+        "day": datetime.date(2020, 1, 2),
+        "time": datetime.time(3, 4, 5),
+        "amount": decimal.Decimal("1.10"),
+        "id": uuid.UUID("12345678123456781234567812345678"),
+        "data": b"\x00\xff",
+        "nested": [(1, "a"), {"b": None}],
+    }
+    encoded = serializer.dumps(value)
+    assert isinstance(encoded, bytes)
+    assert serializer.loads(encoded) == {
+        **value,
+        "nested": [[1, "a"], {"b": None}],
+    }
+
+
+def test_unsupported_type(config):
+    config.commit()
+    serializer = config.registry["pyramid_tasks.serializer"]
+    with pytest.raises(TypeError):
+        serializer.dumps(Point(1, 2))
+
+
+def test_custom_adapter(config):
+    config.add_task_type_adapter(
+        Point, lambda p: [p.x, p.y], lambda v: Point(*v), name="point"
+    )
+    config.commit()
+    serializer = config.registry["pyramid_tasks.serializer"]
+    point = serializer.loads(serializer.dumps([Point(1, 2)]))[0]
+    assert (point.x, point.y) == (1, 2)
+
+
+def test_compression():
+    serializer = TaskSerializer(compress_threshold=100)
+    small = serializer.dumps("a" * 10)
+    large = serializer.dumps("a" * 1000)
+    assert serializer.loads(small) == "a" * 10
+    assert not small.startswith(b"\xc1")
+    assert len(large) < 100
+    assert serializer.loads(large) == "a" * 1000
+
+
+def test_registered_with_kombu(config):
+    config.commit()
+    content_type, encoding, data = serialization.dumps(
+        {"id": uuid.UUID(int=1)}, serializer=SERIALIZER_NAME
+    )
+    assert content_type == CONTENT_TYPE
+    assert encoding == "binary"
+    loaded = serialization.loads(data, content_type, encoding)
+    assert loaded == {"id": uuid.UUID(int=1)}
+
+
+def test_add_task_serializer(config):
+    config.add_task_serializer(
+        "upper",
+        lambda obj: obj.upper(),
+        lambda data: data.lower(),
+        content_type="application/x-upper",
+    )
+    config.commit()
+    content_type, encoding, data = serialization.dumps("abc", "upper")
+    assert data == "ABC"
+    assert serialization.loads(data, content_type, encoding) == "abc"
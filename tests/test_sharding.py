@@ -0,0 +1,45 @@
+import pytest
+from pyramid.exceptions import ConfigurationConflictError
+from pyramid.testing import testConfig as _testConfig
+
+from pyramid_tasks.sharding import FAN_OUT_TASK
+
+
+def shard_task(request, shard, shards):
+    pass
+
+
+@pytest.fixture
+def config():
+    with _testConfig(autocommit=False) as config:
+        config.include("pyramid_tasks")
+        config.register_task(shard_task, name="shard")
+        yield config
+
+
+def test_add_sharded_periodic_task(config):
+    config.add_periodic_task(60, "shard", shards=4, name="nightly")
+    config.add_periodic_task(
+        60, shard_task, partition=lambda request, shards: [[0, 10]]
+    )
+    app = config.make_celery_app()
+    entries = config.registry["pyramid_tasks.sharded_periodic_tasks"]
+    assert entries["nightly"]["shards"] == 4
+    assert entries["nightly"]["task"] is app.tasks["shard"]
+    assert entries["tests.test_sharding.shard_task"]["shards"] is None
+    schedule = app.conf.beat_schedule
+    assert schedule["nightly"]["task"] == FAN_OUT_TASK
+    assert schedule["nightly"]["args"] == ("nightly",)
+    assert FAN_OUT_TASK in app.tasks
+
+
+def test_add_sharded_periodic_task_conflict(config):
+    config.add_periodic_task(60, "shard", shards=4)
+    config.add_periodic_task(60, "shard", shards=2)
+    with pytest.raises(ConfigurationConflictError):
+        config.commit()
+
+
+def test_add_sharded_periodic_task_invalid(config):
+    with pytest.raises(ValueError):
+        config.add_sharded_periodic_task(60, "shard")
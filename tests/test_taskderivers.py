@@ -0,0 +1,25 @@
+from unittest.mock import patch
+
+from pyramid_tasks.taskderivers import TaskDerivers
+
+
+def test_task_derivers_sorted_cached():
+    derivers = TaskDerivers()
+    derivers.add("a", 1)
+    with patch(
+        "pyramid.util.TopologicalSorter.sorted", autospec=True
+    ) as sorted_mock:
+        sorted_mock.return_value = [("a", 1)]
+        assert derivers.sorted() == [("a", 1)]
+        assert derivers.sorted() == [("a", 1)]
+        assert sorted_mock.call_count == 1
+
+
+def test_task_derivers_invalidate():
+    derivers = TaskDerivers()
+    derivers.add("a", 1)
+    assert derivers.sorted() == [("a", 1)]
+    derivers.add("b", 2, before="a")
+    assert derivers.sorted() == [("b", 2), ("a", 1)]
+    derivers.remove("b")
+    assert derivers.sorted() == [("a", 1)]